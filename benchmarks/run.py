@@ -0,0 +1,244 @@
+"""
+Benchmarks of startup, ingest, grading reruns, saving, export and `transfer.py` on a synthetic course.
+
+Usage
+-----
+    python -m benchmarks.run --students 500 --mb 20 --output bench.jsonl
+
+Each case runs in a separate process so that its peak memory (max RSS) is measured independently. The processes
+only import the modules of their case; the synthetic course is generated by the parent.
+Results are printed and, if `--output` is given, appended as JSON lines for tracking regressions.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import toml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SUBJECT = "ベンチマーク"
+ASSIGNMENT = "課題1"
+CASES = ["startup", "ingest", "render", "save", "export", "transfer"]
+# Modules whose import dominates the first load of a page
+HEAVY_MODULES = ("pandas", "numpy", "PIL", "pyarrow")
+# Run in a fresh interpreter, since the benchmark process itself imports PIL for the synthetic data
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=600)
+at.run()
+rendered = time.perf_counter()
+at.run()
+# imported last, so that it is not counted in the heavy modules
+from benchmarks.run import _max_rss_mb
+print(json.dumps({
+    "import_s": round(imported - start, 4),
+    "first_render_s": round(rendered - start, 4),
+    "rerun_s": round(time.perf_counter() - rendered, 4),
+    "heavy_modules": sorted(m for m in sys.argv[2:] if m in sys.modules),
+    "exceptions": [str(e.value) for e in at.exception],
+    "max_rss_mb": _max_rss_mb(),
+}))
+"""
+
+
+def _max_rss_mb() -> float | None:
+    """Peak RSS of this process in MB."""
+    # on Linux, ru_maxrss is inherited from the parent across fork and exec, while VmHWM starts over on exec
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 2)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return round(rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024, 2)
+
+
+def _measure(func) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    extra = func() or {}
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_s": round(wall, 4), "py_peak_mb": round(peak / 1024 / 1024, 2), **extra}
+
+
+def _grading_page():
+    """Create a `GradingPage` with the synthetic assignment selected, outside of a Streamlit script run."""
+    from pages.Grading import GradingPage
+    from utils.assignment_state import get_assignment_state
+
+    page = GradingPage()
+    page.state = get_assignment_state(page.catalog, SUBJECT, ASSIGNMENT)
+    page.assignment_dir = page.state.assignment_dir
+    page.grade_store = page.state.grades
+    page.rubric = page.state.rubric
+    page.students = page.state.students
+    return page
+
+
+def case_startup(workdir: str) -> dict:
+    """
+    Time to first render of `main.py` (`st.navigation` and the default page) in a new process.
+
+    The peak memory is that of the new process, which runs the app.
+    """
+    cmd = [sys.executable, "-c", STARTUP_SCRIPT, os.path.join(ROOT, "main.py"), *HEAVY_MODULES]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        return {"wall_s": round(wall, 4), "returncode": proc.returncode}
+    # the wall time includes the start of the interpreter
+    return {"wall_s": round(wall, 4), **json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def case_ingest(workdir: str) -> dict:
+    from pages.Home import HomePage
+
+    page = HomePage()
+    outdir = os.path.join(page.base_dir, SUBJECT, "ingested")
+    with open(os.path.join(workdir, "assignment.zip"), "rb") as f:
+        return _measure(lambda: page.decompress_zip(f, outdir) and None)
+
+
+def case_render(workdir: str) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "pages", "Grading.py"), default_timeout=600)
+    at.session_state["subject"] = SUBJECT
+    at.session_state["assignment"] = ASSIGNMENT
+    result = _measure(lambda: at.run() and None)
+    # a rerun with nothing changed on disk, e.g. after clicking a checkbox
+    start = time.perf_counter()
+    at.run()
+    result["rerun_s"] = round(time.perf_counter() - start, 4)
+    result["exceptions"] = [str(e.value) for e in at.exception]
+    return result
+
+
+def case_save(workdir: str) -> dict:
+    from utils.grades_csv import get_grades_csv
+    from utils.storage import get_write_behind
+
+    page = _grading_page()
+    leaves = page.state.rubric.ids
+
+    timings = {}
+
+    def save_all():
+        start = time.perf_counter()
+        for i, student in enumerate(page.students):
+            page.selected_student = student
+            page.scores = {leaf: i % 10 for leaf in leaves}
+            page._save_scores()
+        queued = time.perf_counter()
+        # include the writes, so that results stay comparable with those of synchronous saves
+        get_grades_csv(page.assignment_dir).flush()
+        get_write_behind().flush()
+        timings["enqueue_s"] = round(queued - start, 4)
+        timings["drain_s"] = round(time.perf_counter() - queued, 4)
+
+    result = _measure(save_all)
+    result.update(timings)
+    result["per_save_ms"] = round(result["wall_s"] / max(len(page.students), 1) * 1000, 3)
+    return result
+
+
+def case_export(workdir: str) -> dict:
+    page = _grading_page()
+    return _measure(lambda: page._on_download_click(include_json=False))
+
+
+def case_transfer(workdir: str) -> dict:
+    base_dir = toml.load(os.environ["TA_ASSISTANT_CONFIG"])["save"]["dir"]
+    roster = os.path.join(workdir, "roster.xlsx")
+    cmd = [sys.executable, os.path.join(ROOT, "transfer.py"), os.path.join(base_dir, SUBJECT), roster]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    return {"wall_s": round(time.perf_counter() - start, 4), "returncode": proc.returncode}
+
+
+def setup(workdir: str, n_students: int, mb_per_student: float):
+    """Create the synthetic course, its zip archive, the roster and a config pointing at them."""
+    from benchmarks.synthetic import generate_assignment, write_roster, zip_assignment
+
+    base_dir = os.path.join(workdir, "assignments")
+    assignment_dir = generate_assignment(base_dir, SUBJECT, ASSIGNMENT, n_students, mb_per_student)
+    zip_assignment(assignment_dir, os.path.join(workdir, "assignment.zip"))
+    write_roster(os.path.join(workdir, "roster.xlsx"), n_students)
+    config = {"save": {"dir": base_dir}, "cache": {"dir": os.path.join(workdir, "cache")}}
+    with open(os.path.join(workdir, "config.toml"), "w") as f:
+        toml.dump(config, f)
+
+
+def run_case(case: str, workdir: str) -> dict:
+    """Run a case in a child process and return its result."""
+    env = dict(os.environ, TA_ASSISTANT_CONFIG=os.path.join(workdir, "config.toml"))
+    cmd = [sys.executable, "-m", "benchmarks.run", "--case", case, "--workdir", workdir]
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=50, help="number of students")
+    parser.add_argument("--mb", type=float, default=2.0, help="size of attachments per student in MB")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--output", help="append results to this JSONL file")
+    parser.add_argument("--workdir", help="reuse an existing synthetic course")
+    parser.add_argument("--case", choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # child process: run a single case and print its result as JSON
+        result = globals()[f"case_{args.case}"](args.workdir)
+        # the startup case reports the peak of the process running the app
+        result.setdefault("max_rss_mb", _max_rss_mb())
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ta-bench-")
+    if not args.workdir:
+        print(f"Generating {args.students} students x {args.mb} MB in {workdir} ...")
+        setup(workdir, args.students, args.mb)
+
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit.stdout.strip(),
+        "students": args.students,
+        "mb_per_student": args.mb,
+        "results": {},
+    }
+    for case in args.cases:
+        record["results"][case] = result = run_case(case, workdir)
+        print(f"{case:>10}: {json.dumps(result, ensure_ascii=False)}")
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Generator of synthetic PandA-style assignment trees for benchmarks."""
+
+import io
+import json
+import os
+import random
+import zipfile
+
+from PIL import Image
+
+ATTACHMENTS_DIR_NAME = "提出物の添付ファイル"
+
+ALLOCATION = {
+    "問1": {"type": "partial", "score": 20, "answer": ""},
+    "問2": {
+        "(a)": {"type": "full-or-zero", "score": 15, "answer": "n-1"},
+        "(b)": {"type": "full-or-zero", "score": 15, "answer": "n が奇数のとき"},
+    },
+    "問3": {
+        "(a)": {"type": "full-or-zero", "score": 25, "answer": "Hamilton である"},
+        "(b)": {"type": "partial", "score": 25, "answer": ""},
+    },
+}
+
+
+def student_names(n_students: int) -> list[str]:
+    """Return student directory names of the form `Name(ID)`."""
+    return [f"学生{i:04d}({20250000 + i})" for i in range(n_students)]
+
+
+def _write_pdf(path: str, size: int, rng: random.Random):
+    """Write a minimal PDF padded with an incompressible stream of about `size` bytes."""
+    payload = rng.randbytes(max(size - 400, 0))
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n")
+        f.write(b"2 0 obj << /Type /Pages /Kids [] /Count 0 >> endobj\n")
+        f.write(b"3 0 obj << /Length %d >> stream\n" % len(payload))
+        f.write(payload)
+        f.write(b"\nendstream endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n")
+
+
+def _jpeg_templates(size: int, count: int, rng: random.Random) -> list[bytes]:
+    """Create noisy JPEG images of about `size` bytes, which are shared between students."""
+    side = max(int((size / 1.5) ** 0.5), 16)
+    templates = []
+    for _ in range(count):
+        image = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+        exif = image.getexif()
+        exif[0x0112] = rng.choice([1, 3, 6, 8])  # orientation
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90, exif=exif)
+        templates.append(buffer.getvalue())
+    return templates
+
+
+def generate_assignment(
+    base_dir: str,
+    subject: str = "ベンチマーク",
+    assignment: str = "課題1",
+    n_students: int = 50,
+    mb_per_student: float = 2.0,
+    seed: int = 0,
+) -> str:
+    """
+    Create a synthetic assignment directory as downloaded from PandA.
+
+    Each student gets a `*_submissionText.html`, and `提出物の添付ファイル` with a PDF and two JPEGs
+    which together take about `mb_per_student` MB.
+
+    Returns
+    -------
+    str
+        The created assignment directory.
+    """
+    rng = random.Random(seed)
+    assignment_dir = os.path.join(base_dir, subject, assignment)
+    os.makedirs(assignment_dir, exist_ok=True)
+    size = int(mb_per_student * 1024 * 1024)
+    jpegs = _jpeg_templates(size // 4, 4, rng)
+
+    rows = [f"{assignment},ポイント", "", "学生番号,ID,姓,名,成績,提出日時"]
+    for name in student_names(n_students):
+        sid = name.split("(")[-1].rstrip(")")
+        student_dir = os.path.join(assignment_dir, name)
+        attachments_dir = os.path.join(student_dir, ATTACHMENTS_DIR_NAME)
+        os.makedirs(attachments_dir, exist_ok=True)
+        with open(os.path.join(student_dir, f"{name.split('(')[0]}_submissionText.html"), "w", encoding="utf-8") as f:
+            answer = rng.choice(["Euler ではないが Hamilton である", "n-1", "n が奇数のとき", "わかりません"])
+            f.write(f"<p>{answer}</p>\n<p>{sid}</p>\n")
+        _write_pdf(os.path.join(attachments_dir, "report.pdf"), size // 2, rng)
+        for i in range(2):
+            # bytes after the end of the JPEG make each file unique without changing the picture
+            with open(os.path.join(attachments_dir, f"photo{i}.jpg"), "wb") as f:
+                f.write(rng.choice(jpegs) + sid.encode())
+        rows.append(f"{sid},{sid},姓{sid},名{sid},,")
+    with open(os.path.join(assignment_dir, "grades.csv"), "w", encoding="utf-8") as f:
+        f.write("\n".join(rows) + "\n")
+    with open(os.path.join(assignment_dir, "allocation.json"), "w", encoding="utf-8") as f:
+        json.dump(ALLOCATION, f, ensure_ascii=False, indent=4)
+    return assignment_dir
+
+
+def zip_assignment(assignment_dir: str, zip_path: str) -> str:
+    """Compress the assignment directory as a user would before uploading it on the Home page."""
+    top = os.path.basename(assignment_dir)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+        for root, _, files in os.walk(assignment_dir):
+            for file in files:
+                if file == "allocation.json":
+                    continue
+                path = os.path.join(root, file)
+                zf.write(path, os.path.join(top, os.path.relpath(path, assignment_dir)))
+    return zip_path
+
+
+def write_roster(path: str, n_students: int):
+    """Write an Excel roster with the column `学生番号`, as used by `transfer.py`."""
+    import pandas as pd
+
+    ids = [name.split("(")[-1].rstrip(")") for name in student_names(n_students)]
+    pd.DataFrame({"学生番号": ids, "氏名": [f"学生{i}" for i in range(n_students)]}).to_excel(path, index=False)
@@ -5,6 +5,8 @@ pg = st.navigation(
         st.Page("pages/Home.py", title="Home", icon="🏠"),
         st.Page("pages/Grading.py", title="Grading", icon="✏️"),
         st.Page("pages/Allocation.py", title="Allocation", icon="📊"),
+        st.Page("pages/Analytics.py", title="Analytics", icon="📈"),
+        st.Page("pages/Gradebook.py", title="Gradebook", icon="📒"),
         st.Page("pages/Config.py", title="Config", icon="⚙️"),
     ]
 )
@@ -5,6 +5,7 @@ from typing import Literal
 import streamlit as st
 
 from pages.Page import AppPage
+from utils.rubric import RubricError, compile_rubric
 
 
 class Allocation:
@@ -99,8 +100,8 @@ class AllocationPage(AppPage):
         self.max_level = 3
         self.max_width = 10
 
-        subjects = self._list_subdirs(self.base_dir)
-        self.assignments = {sbj: self._list_subdirs(os.path.join(self.base_dir, sbj)) for sbj in subjects}
+        with self.tracer.span("catalog"):
+            self.assignments = self.catalog.assignments_by_subject()
         self.selected_subject = st.session_state.get("subject")
         self.selected_assignment = st.session_state.get("assignment")
 
@@ -114,7 +115,7 @@ class AllocationPage(AppPage):
     def render(self):
         st.header("配点の定義（beta版）", divider="orange")
         try:
-            with open(self.alloc_path, "r") as f:
+            with open(self.alloc_path, "r") as f, self.tracer.span("load_allocation"):
                 alloc_data = json.load(f)
             st.success("配点がすでに定義されています。", icon=":material/check:")
             st.write("JSONファイルの内容：")
@@ -187,7 +188,12 @@ class AllocationPage(AppPage):
     @st.dialog("確認画面", width="large")
     def _on_save(self, allocation_data):
         st.write("以下の配点でよろしいですか？")
-        st.write(f"合計得点：**{self._count_total_score(allocation_data)} 点**")
+        try:
+            rubric = compile_rubric(allocation_data)
+        except RubricError as e:
+            st.error(f"配点データが不正です: {e}")
+            return
+        st.write(f"合計得点：**{rubric.max_total} 点**")
         st.json(allocation_data)
         st.write("保存先ファイル")
         st.code(self.alloc_path, language="shell", wrap_lines=True)
@@ -196,21 +202,10 @@ class AllocationPage(AppPage):
                 json.dump(allocation_data, f, indent=4, ensure_ascii=False)
             st.rerun()
 
-    def _count_total_score(self, allocation_data: dict):
-        """
-        Count the total score from the allocation data.
-        This is used to display the total score in the Grading page.
-        """
-        self.total_score = 0
-        for value in allocation_data.values():
-            if isinstance(value, dict):
-                self.total_score += self._count_total_score(value)
-            elif isinstance(value, (int, float)):
-                self.total_score += value
-        return self.total_score
-
 
 if __name__ == "__main__":
     st.set_page_config(page_title="配点の定義")
     page = AllocationPage()
-    page.render()
+    with page.tracer.span("render"):
+        page.render()
+    page.finish_rerun()
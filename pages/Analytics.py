@@ -0,0 +1,132 @@
+import streamlit as st
+
+from pages.Page import AppPage
+from utils.analytics import assignment_summary, get_score_matrix, get_subject_matrices, subject_total_histogram
+from utils.assignment_state import get_assignment_state
+from utils.rubric import RubricError
+
+ALL_ASSIGNMENTS = "（全課題）"
+
+
+class AnalyticsPage(AppPage):
+    def __init__(self):
+        super().__init__()
+        with self.tracer.span("catalog"):
+            self.assignments = self.catalog.assignments_by_subject()
+        self.selected_subject = st.session_state.get("subject")
+        self.selected_assignment = st.session_state.get("assignment")
+
+    def render(self):
+        st.header("採点結果の分析")
+        with st.sidebar:
+            self.create_sidebar()
+        if not self.selected_subject:
+            st.info("サイドバーから科目を選択してください。")
+            return
+        if self.selected_assignment == ALL_ASSIGNMENTS:
+            with self.tracer.span("subject_analytics"):
+                self.create_subject_view()
+        elif self.selected_assignment:
+            with self.tracer.span("assignment_analytics"):
+                self.create_assignment_view()
+
+    def create_sidebar(self):
+        st.markdown("### 課題の選択")
+        subjects = list(self.assignments.keys())
+        self.selected_subject = st.selectbox(
+            "科目",
+            subjects,
+            index=(subjects.index(self.selected_subject) if self.selected_subject in subjects else None),
+            key="subject_select",
+        )
+        assignment_li = [ALL_ASSIGNMENTS] + self.assignments[self.selected_subject] if self.selected_subject else []
+        self.selected_assignment = st.selectbox(
+            "課題名",
+            assignment_li,
+            index=(
+                assignment_li.index(self.selected_assignment)
+                if self.selected_assignment and self.selected_assignment in assignment_li
+                else 0 if assignment_li else None
+            ),
+            key="assignment_select",
+        )
+        # keep the selection of a single assignment for the other pages
+        st.session_state["subject"] = self.selected_subject
+        if self.selected_assignment != ALL_ASSIGNMENTS:
+            st.session_state["assignment"] = self.selected_assignment
+
+    def create_assignment_view(self):
+        state = get_assignment_state(self.catalog, self.selected_subject, self.selected_assignment)
+        try:
+            with self.tracer.span("score_matrix"):
+                matrix = get_score_matrix(state)
+        except RubricError as e:
+            st.error(f"配点データが不正です: {e}")
+            return
+        if matrix is None:
+            st.warning("配点が定義されていません。")
+            st.page_link("pages/Allocation.py", label="配点を定義する", icon="📊")
+            return
+
+        totals = matrix.totals()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("採点済み", f"{len(totals)} / {len(matrix.students)} 人")
+        col2.metric("平均点", f"{totals.mean():.1f} / {matrix.rubric.max_total}" if len(totals) else "-")
+        col3.metric("中央値", f"{totals.median():.1f}" if len(totals) else "-")
+        col4.metric("標準偏差", f"{totals.std():.1f}" if len(totals) > 1 else "-")
+
+        st.markdown("#### 項目ごとの結果")
+        st.dataframe(
+            matrix.item_summary(),
+            column_config={
+                "満点率": st.column_config.ProgressColumn("満点率", format="percent", min_value=0, max_value=1),
+                "得点率": st.column_config.ProgressColumn("得点率", format="percent", min_value=0, max_value=1),
+                "平均点": st.column_config.NumberColumn("平均点", format="%.2f"),
+            },
+            use_container_width=True,
+        )
+
+        col_item, col_total = st.columns(2)
+        with col_item:
+            st.markdown("#### 項目の得点分布")
+            item = st.selectbox("項目", matrix.rubric.ids, key="analytics_item")
+            st.bar_chart(matrix.histogram(item), x_label="得点", y_label="人数")
+        with col_total:
+            st.markdown("#### 合計得点の分布")
+            st.bar_chart(matrix.total_histogram(), x_label="合計得点", y_label="人数")
+
+    def create_subject_view(self):
+        with self.tracer.span("score_matrices"):
+            matrices = get_subject_matrices(self.catalog, self.selected_subject)
+        if not matrices:
+            st.warning("配点が定義された課題がありません。")
+            return
+
+        st.markdown("#### 課題ごとの結果")
+        st.dataframe(
+            assignment_summary(matrices),
+            column_config={
+                "得点率": st.column_config.ProgressColumn("得点率", format="percent", min_value=0, max_value=1),
+                "平均点": st.column_config.NumberColumn("平均点", format="%.1f"),
+                "中央値": st.column_config.NumberColumn("中央値", format="%.1f"),
+                "標準偏差": st.column_config.NumberColumn("標準偏差", format="%.1f"),
+            },
+            use_container_width=True,
+        )
+
+        col_total, col_item = st.columns(2)
+        with col_total:
+            st.markdown("#### 科目合計の分布")
+            st.bar_chart(subject_total_histogram(matrices), x_label="合計得点", y_label="人数")
+        with col_item:
+            st.markdown("#### 項目ごとの満点率")
+            assignment = st.selectbox("課題", list(matrices), key="analytics_rates_assignment")
+            rates = matrices[assignment].item_summary()["満点率"]
+            st.bar_chart(rates, x_label="項目", y_label="満点率", horizontal=True)
+
+
+if __name__ == "__main__":
+    st.set_page_config(page_title="Analytics", layout="wide")
+    page = AnalyticsPage()
+    page.render()
+    page.finish_rerun()
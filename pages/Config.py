@@ -1,10 +1,27 @@
 import os
-import shutil
+import threading
+from functools import partial
 
 import streamlit as st
 import toml
 
 from pages.Page import AppPage
+from utils.migration import MigrationError, get_active_migration, interrupted_migration, start_migration
+from utils.storage import FLUSH_TIMEOUT, cloud_provider, get_write_behind
+
+
+def set_save_dir(config_path: str, new_dir: str):
+    """
+    Rewrite `save.dir` in the config file, keeping the other settings as they are in the file.
+
+    Called by the migration thread, so it does not use the state of a page.
+    """
+    config = toml.load(config_path) if os.path.exists(config_path) else {}
+    config.setdefault("save", {})["dir"] = new_dir
+    tmp_path = f"{config_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        toml.dump(config, f)
+    os.replace(tmp_path, config_path)
 
 
 class ConfigPage(AppPage):
@@ -58,37 +75,115 @@ class ConfigPage(AppPage):
                 st.error("指定されたパスはディレクトリではありません。")
 
             move_needed = self.has_assignments(curr_dir) and dir_valid and new_dir != curr_dir
-            move_assign = False
+            move_assign = remove_source = False
             if move_needed:
                 move_assign = st.checkbox("変更後のフォルダに既存のデータをコピーする", value=True)
+                remove_source = move_assign and st.checkbox(
+                    "コピー後に元のフォルダからデータを削除する（移動）",
+                    value=False,
+                    help="同じドライブ内の移動は、ファイルをコピーせずに名前の変更だけで完了します。",
+                )
             if st.button("保存", key="save_btn", disabled=(curr_dir == new_dir), icon=":material/check:"):
-                # copy contents to the new directory
                 if move_needed and move_assign:
-                    with st.status("Copying assignments...", expanded=True):
-                        for item in os.listdir(curr_dir):
-                            st.write(f"Copying `{item}`...")
-                            s = os.path.join(curr_dir, item)
-                            d = os.path.join(new_dir, item)
-                            if os.path.isdir(s):
-                                shutil.copytree(s, d, dirs_exist_ok=True)
-                            else:
-                                shutil.copy2(s, d)
-                        st.write("Done!")
-                self.config["save"]["dir"] = new_dir
-                self.save_config()
-                st.session_state["just_saved"] = True
+                    # the save directory is switched by the migration once all files are verified
+                    if self.start_migration(curr_dir, new_dir, remove_source):
+                        st.rerun()
+                else:
+                    self._set_base_dir(new_dir)
+                    st.session_state["just_saved"] = True
+                    st.rerun()
+
+    def start_migration(self, source: str, dest: str, move: bool) -> bool:
+        """Start copying (or moving) the data to the new save directory in the background. Return True if started."""
+        # write queued grades and comments before they are copied
+        write_behind = get_write_behind()
+        if not write_behind.flush(FLUSH_TIMEOUT):
+            st.error("保存先への書き込みが終わっていません。しばらく待ってから再試行してください。")
+            return False
+        if write_behind.failed:
+            st.error("保存先に書き込めなかった変更があります。採点ページから再試行するか破棄してください。")
+            return False
+        try:
+            start_migration(
+                source, dest, move, self.config["cache"]["dir"], on_complete=partial(set_save_dir, self.CONFIG_PATH)
+            )
+        except MigrationError as e:
+            st.error(str(e))
+            return False
+        return True
+
+    def _set_base_dir(self, new_dir: str):
+        """Switch the save directory, keeping the other settings as they are in the file."""
+        set_save_dir(self.CONFIG_PATH, new_dir)
+        self.config = self.load_config()
+
+    @st.fragment(run_every=1.0)
+    def show_migration_progress(self):
+        """Show the progress of the running migration until it is done."""
+        migration = get_active_migration()
+        progress = migration.progress
+        if progress.phase == "done":
+            st.session_state["just_saved"] = True
+            st.rerun()
+        labels = {
+            "scan": "ファイルを確認中",
+            "copy": "コピー中",
+            "verify": "チェックサムを検証中",
+            "switch": "保存先を切り替え中",
+            "cleanup": "後片付け中",
+        }
+        st.progress(
+            progress.fraction,
+            text=f"{labels.get(progress.phase, progress.phase)}: {progress.done_files} / {progress.total_files} ファイル",
+        )
+        st.caption(f"`{migration.source}` → `{migration.dest}`　ブラウザのタブを閉じてもデータ移行は続行されます。")
+
+    def show_migration_status(self):
+        """Show the running, failed or interrupted migration of the save directory, with a button to resume it."""
+        migration = get_active_migration()
+        if migration and migration.progress.phase not in ("done", "failed"):
+            self.show_migration_progress()
+            return
+        if migration and migration.progress.phase == "failed":
+            st.error(f"データ移行に失敗しました: {migration.progress.error}", icon=":material/error:")
+            pending = {"source": migration.source, "dest": migration.dest, "move": migration.move}
+        else:
+            pending = interrupted_migration(self.config["cache"]["dir"])
+            if not pending:
+                return
+            st.warning(
+                f"前回のデータ移行が完了していません: `{pending['source']}` → `{pending['dest']}`",
+                icon=":material/warning:",
+            )
+        if pending["move"]:
+            self.show_split_data_note(pending["source"], pending["dest"])
+        if st.button("データ移行を再開", key="resume_migration_btn", icon=":material/restart_alt:"):
+            if self.start_migration(pending["source"], pending["dest"], pending["move"]):
                 st.rerun()
 
+    def show_split_data_note(self, source: str, dest: str):
+        """Tell where the data is after a move stopped partway, since some entries may already be in `dest`."""
+        curr_dir = os.path.abspath(self.load_config()["save"]["dir"])
+        if curr_dir == os.path.abspath(dest):
+            st.info(
+                f"保存先は `{dest}` に切り替わっています。元のフォルダ `{source}` にデータが残っている場合があります。",
+                icon=":material/info:",
+            )
+        elif self.has_assignments(dest):
+            st.info(
+                f"データの一部はすでに移行先 `{dest}` に移動されており、保存先は `{source}` のままです。"
+                "採点を続ける前に「データ移行を再開」で残りのデータを移動してください。",
+                icon=":material/info:",
+            )
+
     @st.fragment
     def create_basedir_config(self):
         curr_dir = self.config.get("save", {}).get("dir", "")
         # badges to indicate the storage type
-        if "OneDrive" in curr_dir:
-            badge_str = ":blue-badge[:material/check: OneDrive]"
-        elif "Google Drive" in curr_dir or "GoogleDrive" in curr_dir:
-            badge_str = ":green-badge[:material/check: Google Drive]"
-        elif "Mobile Documents" in curr_dir:
-            badge_str = ":red-badge[:material/check: iCloud]"
+        provider = cloud_provider(curr_dir)
+        if provider:
+            color = {"OneDrive": "blue", "Google Drive": "green", "iCloud": "red"}.get(provider, "violet")
+            badge_str = f":{color}-badge[:material/check: {provider}]"
         else:
             badge_str = ":gray-badge[:material/check: Local]"
         st.markdown("#### 課題データの保存先")
@@ -97,6 +192,7 @@ class ConfigPage(AppPage):
             help="採点データを保存するフォルダ。OneDrive や Google Drive で管理されたパスを指定すると、デバイス間での同期・バックアップが可能",
         )
         st.code(curr_dir, language="plaintext", wrap_lines=True)
+        self.show_migration_status()
         st.button("変更", on_click=self.change_base_dir_dialog, key="change_base_dir_btn", icon=":material/folder:")
 
     def create_height_config(self):
@@ -116,6 +212,44 @@ class ConfigPage(AppPage):
             self.save_config()
             st.session_state["just_saved"] = True
 
+    def create_grader_config(self):
+        """Configure the name recorded with saved scores, which separates the data of each grader."""
+        st.markdown("#### 採点者")
+        name = st.text_input(
+            "採点者名",
+            value=self.config["grader"]["name"],
+            placeholder=self.grader,
+            help="複数人で同じフォルダを採点する場合、採点者ごとに異なる名前を設定してください。空欄の場合は「ユーザー名@コンピュータ名」を使用します。",
+            key="grader_name",
+        )
+        if st.button("保存", key="save_grader_btn", icon=":material/check:"):
+            self.config["grader"]["name"] = name.strip()
+            self.save_config()
+            st.session_state["just_saved"] = True
+            st.rerun()
+
+    def create_debug_config(self):
+        """Configure the timing panel and trace file used to investigate slow reruns."""
+        st.markdown("#### Debug")
+        panel = st.toggle(
+            "処理時間パネルを表示",
+            value=self.config["debug"]["panel"],
+            help="各ページのサイドバーに、再実行ごとの処理時間の内訳を表示します。",
+            key="debug_panel",
+        )
+        trace_file = st.text_input(
+            "トレースファイル（JSONL）",
+            value=self.config["debug"]["trace_file"],
+            help="指定すると、再実行ごとの処理時間をこのファイルに追記します。空欄の場合は記録しません。",
+            key="debug_trace_file",
+        )
+        if st.button("保存", key="save_debug_btn", icon=":material/check:"):
+            self.config["debug"]["panel"] = panel
+            self.config["debug"]["trace_file"] = trace_file.strip()
+            self.save_config()
+            st.session_state["just_saved"] = True
+            st.rerun()
+
     def create_reset_button(self):
         """Reset the configuration to default values."""
 
@@ -139,6 +273,8 @@ class ConfigPage(AppPage):
         st.header("Configuration", divider="orange")
         self.create_basedir_config()
         self.create_height_config()
+        self.create_grader_config()
+        self.create_debug_config()
         with st.sidebar:
             self.create_reset_button()
             st.link_button(
@@ -152,3 +288,4 @@ if __name__ == "__main__":
     st.set_page_config(page_title="Config")
     page = ConfigPage()
     page.render()
+    page.finish_rerun()
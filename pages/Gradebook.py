@@ -0,0 +1,71 @@
+import streamlit as st
+
+from pages.Page import AppPage
+from utils.gradebook import get_gradebook
+
+
+class GradebookPage(AppPage):
+    def __init__(self):
+        super().__init__()
+        with self.tracer.span("catalog"):
+            self.subjects = self.catalog.subjects()
+        self.selected_subject = st.session_state.get("subject")
+
+    def render(self):
+        st.header("成績一覧")
+        with st.sidebar:
+            st.markdown("### 科目の選択")
+            self.selected_subject = st.selectbox(
+                "科目",
+                self.subjects,
+                index=(self.subjects.index(self.selected_subject) if self.selected_subject in self.subjects else None),
+                key="subject_select",
+            )
+            st.session_state["subject"] = self.selected_subject
+        if not self.selected_subject:
+            st.info("サイドバーから科目を選択してください。")
+            return
+
+        gradebook = get_gradebook(self.catalog, self.selected_subject)
+        with self.tracer.span("gradebook"):
+            table = gradebook.table()
+        assignments = [c for c in table.columns if c not in ("氏名", "合計", "提出", "未提出", "未採点")]
+        if not assignments:
+            st.warning("課題が登録されていません。")
+            return
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("学生数", f"{len(table)} 人")
+        col2.metric("課題数", len(assignments))
+        col3.metric("未提出のある学生", f"{int((table['未提出'] > 0).sum())} 人")
+        col4.metric("未採点の提出物", f"{int(table['未採点'].sum())} 件")
+
+        filter_option = st.segmented_control(
+            "表示する学生", ["すべて", "未提出あり", "未採点あり"], default="すべて", key="gradebook_filter"
+        )
+        if filter_option == "未提出あり":
+            table = table[table["未提出"] > 0]
+        elif filter_option == "未採点あり":
+            table = table[table["未採点"] > 0]
+
+        with self.tracer.span("table"):
+            st.dataframe(
+                table,
+                column_config={a: st.column_config.NumberColumn(a, format="%g") for a in assignments + ["合計"]},
+                height=self.config["window"]["grading_height"],
+                use_container_width=True,
+            )
+        st.download_button(
+            "CSVをダウンロード",
+            table.to_csv().encode("utf-8-sig"),
+            file_name=f"{self.selected_subject}_成績一覧.csv",
+            mime="text/csv",
+            icon=":material/download:",
+        )
+
+
+if __name__ == "__main__":
+    st.set_page_config(page_title="Gradebook", layout="wide")
+    page = GradebookPage()
+    page.render()
+    page.finish_rerun()
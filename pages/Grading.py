@@ -1,18 +1,37 @@
-import base64
-import csv
-import io
-import json
 import os
-import shutil
-import tempfile
-import zipfile
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import streamlit as st
-from PIL import ExifTags, Image
 
 from pages.Page import AppPage
+from utils.assignment_state import get_assignment_state
+from utils.clustering import cluster_assignment, get_clustering
+from utils.export import write_export_zip
+from utils.file_server import file_url
+from utils.grade_store import LEGACY_JOURNAL_NAME, SHARDS_DIR_NAME, SNAPSHOT_NAME
+from utils.grades_csv import get_grades_csv
+from utils.prefetch import get_prefetcher
+from utils.previews import PREVIEW_EXTENSIONS
+from utils.rubric import RubricError
+from utils.storage import (
+    FLUSH_TIMEOUT,
+    WritesBlockedError,
+    get_write_behind,
+    guarded_write,
+    write_behind_enabled,
+    write_text_atomic,
+    writes_blocked,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# number of students whose submissions are loaded ahead
+PREFETCH_COUNT = 3
+# Number of students listed in the search results
+SEARCH_RESULTS = 30
 
 
 class GradingPage(AppPage):
@@ -23,8 +42,8 @@ class GradingPage(AppPage):
         self.base_dir = self.config["save"]["dir"]
         self.assignment_dir = None
         os.makedirs(self.base_dir, exist_ok=True)
-        subjects = self._list_subdirs(self.base_dir)
-        self.assignments = {sbj: self._list_subdirs(os.path.join(self.base_dir, sbj)) for sbj in subjects}
+        with self.tracer.span("catalog"):
+            self.assignments = self.catalog.assignments_by_subject()
 
         # initialize selections
         self.selected_subject = st.session_state.get("subject")
@@ -32,12 +51,17 @@ class GradingPage(AppPage):
         self.selected_student = None
 
         # data for each assignment
-        self.allocation = {}
+        self.state = None
+        self.rubric = None
+        self.rubric_error = None
+        self.grade_store = None
         self.students = []
         self.total_count = None
         self.graded_count = None
 
         # data for each student (i.e. submission)
+        self.prefetcher = get_prefetcher(self.image_cache, self.mirror)
+        self.submission = None
         self.scores = {}
         self.saved_scores = {}
         self.comment_text = ""
@@ -84,19 +108,35 @@ class GradingPage(AppPage):
 
         if self.selected_assignment:
             self.assignment_dir = os.path.join(self.base_dir, self.selected_subject, self.selected_assignment)
-            self.allocation = self._load_allocation(self.assignment_dir)
+            with self.tracer.span("assignment_state"):
+                self.state = get_assignment_state(self.catalog, self.selected_subject, self.selected_assignment)
+                try:
+                    self.rubric = self.state.rubric
+                except RubricError as e:
+                    self.rubric_error = e
+                self.grade_store = self.state.grades
             # student selection
-            self.create_student_selection()
+            with self.tracer.span("student_selection"):
+                self.create_student_selection()
 
             # display progress
-            grades_file = os.path.join(self.assignment_dir, "detailed_grades.json")
-            try:
-                with open(grades_file, encoding="utf-8") as gf:
-                    graded = json.load(gf)
-                self.graded_count = len(graded)
-            except FileNotFoundError:
-                self.graded_count = 0
-            self.total_count = len(self.students)
+            with self.tracer.span("progress"):
+                self.graded_count = self.state.graded_count
+                self.total_count = self.state.total_count
+
+            self.create_search()
+            self.create_clustering()
+
+        # Grading mode
+        st.markdown("### 採点モード")
+        st.radio(
+            "採点モード",
+            ["個別", "一括"],
+            key="grading_mode",
+            horizontal=True,
+            label_visibility="collapsed",
+            help="一括: 全学生を表形式で採点します",
+        )
 
         # Default scores
         st.markdown("### 採点の初期値")
@@ -107,6 +147,7 @@ class GradingPage(AppPage):
             f"##### 採点済み: {self.graded_count} / {self.total_count}" if self.total_count else "#### 採点済み: 0 / 0"
         )
         st.progress(self.graded_count / self.total_count if self.total_count else 0)
+        self.show_write_errors()
 
         # Download button
         st.divider()
@@ -119,8 +160,89 @@ class GradingPage(AppPage):
         if st.button("採点結果をダウンロード", key="download_grades"):
             self._on_download_click(include_json)
 
+    def show_write_errors(self):
+        """Show the writes to the save directory which are being retried or failed, or blocked by a migration."""
+        if writes_blocked(self.base_dir):
+            st.warning("保存先のデータ移行中のため、採点結果とコメントは保存できません。移行が終わるまでお待ちください。")
+        write_behind = get_write_behind()
+        if write_behind.last_error:
+            st.warning(
+                f"保存先への書き込みを再試行しています（未書き込み: {write_behind.pending} 件）: {write_behind.last_error}"
+            )
+        failed = write_behind.failed
+        if not failed:
+            return
+        st.error(
+            "保存先に書き込めなかった変更があります。保存先を確認してから再試行してください。\n\n"
+            + "\n".join(f"- {w.label}: {w.error}" for w in failed)
+        )
+        col1, col2 = st.columns(2)
+        if col1.button("再試行", key="retry_failed_writes"):
+            write_behind.retry_failed()
+            st.rerun()
+        if col2.button("破棄", key="discard_failed_writes", help="書き込めなかった変更を取り消します"):
+            write_behind.discard_failed()
+            st.rerun()
+
+    def create_search(self):
+        """Search the submitted texts and PDFs, and list the students found."""
+        st.markdown("### 提出物の検索")
+        query = st.text_input(
+            "検索語", key="search_query", placeholder="例: Hamilton", label_visibility="collapsed"
+        )
+        scope = st.radio(
+            "検索範囲", ["この課題", "科目全体"], key="search_scope", horizontal=True, label_visibility="collapsed"
+        )
+        if not query:
+            return
+        assignments = [self.selected_assignment] if scope == "この課題" else self.assignments[self.selected_subject]
+        with self.tracer.span("search"):
+            hits = {}
+            indexing = False
+            for assignment in assignments:
+                index = self.search_index(os.path.join(self.base_dir, self.selected_subject, assignment))
+                for hit in index.search(query):
+                    # one result per student, even if several files match
+                    hits.setdefault((assignment, hit.student), hit)
+                indexing |= index.indexing
+        st.caption(f"{len(hits)} 人が該当" + ("（上位のみ表示）" if len(hits) > SEARCH_RESULTS else ""))
+        if indexing:
+            st.caption("索引を作成中です。まだ検索されていない提出物があります。")
+        for i, ((assignment, student), hit) in enumerate(list(hits.items())[:SEARCH_RESULTS]):
+            label = student.split("(")[0] + ("" if assignment == self.selected_assignment else f"（{assignment}）")
+            st.button(
+                label,
+                key=f"search_hit_{i}",
+                help=hit.snippet,
+                on_click=self._on_search_hit_click,
+                args=(assignment, student),
+                use_container_width=True,
+            )
+
+    def create_clustering(self):
+        """Detect groups of near-duplicate answers, which can then be graded at once."""
+        st.markdown("### 類似回答")
+        if st.button("類似回答を検出", key="detect_clusters", icon=":material/join:"):
+            with st.spinner("類似回答を検出中..."), self.tracer.span("clustering"):
+                cluster_assignment(self.search_index(self.assignment_dir))
+        clustering = get_clustering(self.assignment_dir)
+        if clustering is not None:
+            st.caption(
+                f"{len(clustering.clusters)} グループ（{sum(len(c) for c in clustering.clusters)} 人）"
+                if clustering.clusters
+                else "類似回答は見つかりませんでした。"
+            )
+
+    def _on_search_hit_click(self, assignment: str, student: str):
+        st.session_state["assignment"] = assignment
+        st.session_state["student_index"] = self.catalog.students(self.selected_subject, assignment).index(student)
+        st.session_state["grading_mode"] = "個別"
+        # the selectboxes are created again from the session state above
+        for key in ("assignment_select", "student_select"):
+            st.session_state.pop(key, None)
+
     def create_student_selection(self):
-        self.students = self._list_subdirs(self.assignment_dir)
+        self.students = self.state.students
         sel = st.selectbox(
             "学生氏名",
             self.students,
@@ -132,20 +254,13 @@ class GradingPage(AppPage):
         self.selected_student = self.students[st.session_state["student_index"]]
 
         # load saved scores
-        try:
-            grades_file = os.path.join(self.assignment_dir, "detailed_grades.json")
-            with open(grades_file, encoding="utf-8") as gf:
-                all_data = json.load(gf)
-            self.saved_scores = all_data.get(self.selected_student, {})
-        except FileNotFoundError:
-            self.saved_scores = {}
-
-        # load comments as HTML
-        comments_path = os.path.join(self.assignment_dir, self.selected_student, "comments.txt")
-        if os.path.isfile(comments_path):
-            self.comment_text = Path(comments_path).read_text(encoding="utf-8")
-        else:
-            self.comment_text = ""
+        with self.tracer.span("load_scores"):
+            self.saved_scores = self.grade_store.get(self.selected_student)
+
+        # load the submission (prefetched while grading the previous student)
+        with self.tracer.span("load_submission"):
+            self.submission = self.prefetcher.get(os.path.join(self.assignment_dir, self.selected_student))
+        self.comment_text = self.submission.comment_text
 
     def create_widgets(self):
         """Create widgets for displaying and grading student submissions."""
@@ -153,20 +268,27 @@ class GradingPage(AppPage):
             st.warning("科目と課題を選択してください。")
             return
 
-        student_dir = os.path.join(self.assignment_dir, self.selected_student)
-        htmls = list(Path(student_dir).glob("*_submissionText.html"))
-        html_content = htmls and Path(htmls[0]).read_text(encoding="utf-8").strip() or None
-
-        attachments_dir = os.path.join(student_dir, "提出物の添付ファイル")
-        attachments = sorted(os.listdir(attachments_dir)) if os.path.isdir(attachments_dir) else []
+        if st.session_state.get("grading_mode") == "一括":
+            with self.tracer.span("bulk_grading"):
+                self.create_bulk_grading()
+            return
 
+        submission = self.submission
         col_main, col_grade = st.columns([3, 1], border=True)
         HEIGHT = self.config["window"]["grading_height"]  # default height for the submission tab
-        with col_main:
-            self.create_submission_tab(attachments, html_content, attachments_dir, HEIGHT)
-        with col_grade:
+        with col_main, self.tracer.span("submission_tab"):
+            self.create_submission_tab(
+                submission.attachments, submission.html_content, submission.attachments_dir, HEIGHT
+            )
+        with col_grade, self.tracer.span("grading_tab"):
             self.create_grading_tab(HEIGHT)
 
+        # warm up the next students while the current one is being graded
+        with self.tracer.span("prefetch"):
+            idx = st.session_state["student_index"]
+            next_students = [self.students[(idx + i) % len(self.students)] for i in range(1, PREFETCH_COUNT + 1)]
+            self.prefetcher.prefetch([os.path.join(self.assignment_dir, s) for s in next_students])
+
     def create_submission_tab(
         self,
         attachments: list[str],
@@ -188,10 +310,23 @@ class GradingPage(AppPage):
         HEIGHT : int
             Height of the iframe and containers for displaying attachments.
         """
-        # organize attachments by type
+        # organize attachments by type, showing HEIC images and office documents by their previews
         pdfs, images, others = [], [], []
+        previews, pending = {}, []
         for f in attachments:
             ext = Path(f).suffix.lower()
+            if ext in PREVIEW_EXTENSIONS:
+                file_path = os.path.join(attachments_dir, f)
+                with self.tracer.span("preview_lookup"):
+                    preview = self.preview_cache.lookup(file_path)
+                if preview:
+                    previews[f] = preview
+                    ext = Path(preview).suffix
+                elif self.preview_cache.supports(file_path):
+                    # converted at ingest; queue again in case it was added by other means
+                    self.preview_cache.submit([file_path])
+                    if self.preview_cache.is_pending(file_path):
+                        pending.append(f)
             match ext:
                 case ".pdf":
                     pdfs.append(f)
@@ -222,43 +357,30 @@ class GradingPage(AppPage):
         # display PDFs
         for idx, pdf in enumerate(pdfs):
             with tabs[idx]:
-                file_path = os.path.join(attachments_dir, pdf)
-                with open(file_path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
+                if pdf in previews:
+                    url = file_url(previews[pdf], self.preview_cache.cache_dir, port=self.config["file_server"]["port"])
+                else:
+                    url = self._file_url(self._local_copy(os.path.join(attachments_dir, pdf)))
                 st.markdown(f"#### {pdf}")
-                st.markdown(
-                    f'<iframe src="data:application/pdf;base64,{b64}" width=100% height={HEIGHT}px></iframe>',
-                    unsafe_allow_html=True,
-                )
+                with self.tracer.span("pdf"):
+                    st.markdown(
+                        f'<iframe src="{url}" width=100% height={HEIGHT}px></iframe>',
+                        unsafe_allow_html=True,
+                    )
         # display images
         for idx, img in enumerate(images, start=len(pdfs)):
             with tabs[idx]:
-                file_path = os.path.join(attachments_dir, img)
+                file_path = previews.get(img) or os.path.join(attachments_dir, img)
                 # st.markdown(f"#### {img}")
-                ext = Path(img).suffix.lower()
+                ext = Path(file_path).suffix.lower()
                 match ext:
-                    case ".jpg" | ".jpeg":
+                    case ".jpg" | ".jpeg" | ".png":
                         try:
-                            image = Image.open(file_path)
-                            # check and apply EXIF orientation
-                            exif = image._getexif()
-                            if exif is not None:
-                                orientation_key = next(
-                                    (k for k, v in ExifTags.TAGS.items() if v == "Orientation"),
-                                    None,
-                                )
-                                if orientation_key and orientation_key in exif:
-                                    orientation = exif[orientation_key]
-                                else:
-                                    orientation = 1
-                                if orientation == 3:
-                                    image = image.rotate(180, expand=True)
-                                elif orientation == 6:
-                                    image = image.rotate(270, expand=True)
-                                elif orientation == 8:
-                                    image = image.rotate(90, expand=True)
+                            # oriented and downscaled image from the cache
+                            with self.tracer.span("image_cache"):
+                                image = self.image_cache.get(self._local_copy(file_path))
                             st.markdown(f"#### {img}")
-                            with st.container(height=HEIGHT, border=False):
+                            with st.container(height=HEIGHT, border=False), self.tracer.span("image"):
                                 st.image(image, use_container_width=True)
                         except Exception as e:
                             # show the original image if rotation fails
@@ -266,10 +388,6 @@ class GradingPage(AppPage):
                             with st.container(height=HEIGHT, border=False):
                                 st.warning(f"画像の読み込みまたは回転に失敗しました: {e}")
                                 st.image(file_path, use_container_width=True)
-                    case ".png":
-                        st.markdown(f"#### {img}")
-                        with st.container(height=HEIGHT, border=False):
-                            st.image(file_path, use_container_width=True)
                     case _:
                         st.warning(f"サポートされていない画像形式: {ext}. 画像を表示できません。")
         # display other files
@@ -278,7 +396,8 @@ class GradingPage(AppPage):
                 st.markdown("#### その他のファイル")
                 for other in others:
                     file_path = os.path.join(attachments_dir, other)
-                    st.markdown(f"- [{other}](`{file_path}`)")
+                    note = "（プレビューを作成中）" if other in pending else ""
+                    st.markdown(f"- [{other}]({self._file_url(file_path)}){note}")
         # submitted texts
         if html_content:
             idx = labels.index("提出テキスト")
@@ -297,6 +416,16 @@ class GradingPage(AppPage):
             st.markdown("#### 採点結果")
             self.create_checkboxes(height)
 
+            # near-duplicate answers
+            cluster = self._cluster_of_selected()
+            if cluster and self.rubric and not self.rubric_error:
+                others = [s for s in cluster if s != self.selected_student]
+                st.checkbox(
+                    f"類似回答の {len(others)} 人にも同じ得点を適用",
+                    key=f"apply_to_cluster_{self.selected_student}",
+                    help="、".join(s.split("(")[0] for s in others),
+                )
+
             # Comment section
             st.markdown("#### コメント")
             if self.comment_text:
@@ -346,7 +475,7 @@ class GradingPage(AppPage):
     @st.fragment
     def create_checkboxes(self, height: int) -> int | None:
         """
-        Create checkboxes for grading based on the allocation structure.
+        Create checkboxes for grading based on the compiled rubric of the allocation.
 
         Parameters
         ----------
@@ -359,23 +488,29 @@ class GradingPage(AppPage):
             The total score calculated from the checkboxes, or None if no allocation.json is given.
         """
         self.scores = {}
-        if not self.allocation:
+        if self.rubric_error:
+            st.error(f"配点データが不正です: {self.rubric_error}")
+            if st.button("配点を確認"):
+                st.switch_page("pages/Allocation.py")
+            return None
+        if not self.rubric:
             st.warning("採点項目が設定されていません。")
             if st.button("配点を設定"):
                 st.switch_page("pages/Allocation.py")
             return None
 
-        def recurse(prefix: str, alloc: dict):
-            suffix = prefix.split("_")[-1]
-            if isinstance(alloc, dict) and "score" in alloc and "type" in alloc:
-                max_score = int(alloc["score"])
-                key = prefix
-                widget_key = f"{self.selected_student}_{prefix}".replace(" ", "_")
+        rubric = self.rubric
+        with st.container(height=height - 360, border=False):
+            for i, key in enumerate(rubric.ids):
+                for heading in rubric.headings[i]:
+                    st.markdown(heading)
+                max_score = rubric.max_scores[i]
+                widget_key = f"{self.selected_student}_{key}".replace(" ", "_")
                 prev_val = self.saved_scores.get(key, max_score if self.full_score_as_default else 0)
-                match alloc["type"]:
+                match rubric.types[i]:
                     case "partial":
                         val = st.number_input(
-                            suffix,
+                            rubric.labels[i],
                             min_value=0,
                             max_value=max_score,
                             value=prev_val,
@@ -384,26 +519,91 @@ class GradingPage(AppPage):
                         )
                     case "full-or-zero":
                         checked = st.checkbox(
-                            suffix,
+                            rubric.labels[i],
                             value=(prev_val == max_score),
                             key=widget_key,
-                            help=str(alloc.get("answer", "")),
+                            help=rubric.answers[i],
                         )
                         val = max_score if checked else 0
                 self.scores[key] = val
-            elif isinstance(alloc, dict):
-                st.markdown(prefix)
-                for k, v in alloc.items():
-                    new_pref = f"{prefix}_{k}" if prefix else k
-                    recurse(new_pref, v)
-            else:
-                st.warning(f"不正なデータ形式: {prefix} -> {alloc}")
 
-        with st.container(height=height - 360, border=False):
-            for q_key, q_val in self.allocation.items():
-                recurse(q_key, q_val)
+        st.markdown(f"**合計得点: {rubric.total(self.scores)} 点**")
 
-        st.markdown(f"**合計得点: {sum(self.scores.values())} 点**")
+    def create_bulk_grading(self):
+        """Create a table for grading all students at once, with students as rows and rubric items as columns."""
+        if self.rubric_error or not self.rubric:
+            st.warning("採点項目が設定されていません。" if not self.rubric_error else f"配点データが不正です: {self.rubric_error}")
+            return
+        # imported here, since pandas takes a noticeable part of the first load of the page
+        import pandas as pd
+
+        rubric = self.rubric
+        saved = self.grade_store.to_dict()
+        default = (lambda i: rubric.max_scores[i]) if self.full_score_as_default else (lambda i: 0)
+
+        # columns of the table: display names, then one column per rubric item
+        data = {"学生": [s.split("(")[0] for s in self.students]}
+        column_config = {"学生": st.column_config.TextColumn("学生", disabled=True)}
+        for i, key in enumerate(rubric.ids):
+            values = [saved.get(s, {}).get(key, default(i)) for s in self.students]
+            if rubric.types[i] == "full-or-zero":
+                data[key] = [v == rubric.max_scores[i] for v in values]
+                column_config[key] = st.column_config.CheckboxColumn(
+                    f"{key} ({rubric.max_scores[i]})", help=rubric.answers[i] or None
+                )
+            else:
+                data[key] = values
+                column_config[key] = st.column_config.NumberColumn(
+                    f"{key} ({rubric.max_scores[i]})", min_value=0, max_value=rubric.max_scores[i], step=1
+                )
+        original = pd.DataFrame(data, index=self.students)
+
+        editor_key = f"bulk_editor_{self.assignment_dir}"
+        edited = st.data_editor(
+            original,
+            key=editor_key,
+            column_config=column_config,
+            hide_index=True,
+            num_rows="fixed",
+            height=self.config["window"]["grading_height"],
+            use_container_width=True,
+        )
+
+        # totals of all students, computed column-wise
+        matrix = self._to_score_matrix(edited)
+        totals = matrix.sum(axis=1)
+        changed = (edited[list(rubric.ids)] != original[list(rubric.ids)]).any(axis=1)
+        # ungraded students are saved with the shown scores too, since the defaults are often correct
+        unsaved = pd.Series([s not in saved for s in edited.index], index=edited.index)
+        to_save = changed | unsaved
+        st.markdown(
+            f"**保存される学生: {int(to_save.sum())} 人**（変更 {int(changed.sum())} 人・未採点 "
+            f"{int((unsaved & ~changed).sum())} 人） / 平均点: {totals.mean():.1f} 点"
+        )
+        if st.button("表示中の採点をまとめて保存", icon=":material/save:", disabled=not to_save.any(), type="primary"):
+            grades = {s: {k: int(v) for k, v in matrix.loc[s].items()} for s in edited.index[to_save]}
+            try:
+                self.grade_store.save_many(grades, self.grader)
+                get_grades_csv(self.assignment_dir).update_many(
+                    {s.split("(")[-1].rstrip(")"): int(totals[s]) for s in grades}
+                )
+            except (ValueError, WritesBlockedError) as e:
+                st.error(str(e))
+                return
+            del st.session_state[editor_key]
+            st.session_state["bulk_saved"] = len(grades)
+            st.rerun()
+        if st.session_state.get("bulk_saved"):
+            st.toast(f"{st.session_state.pop('bulk_saved')} 人の採点結果を保存しました！", icon="🎉")
+
+    def _to_score_matrix(self, table: "pd.DataFrame") -> "pd.DataFrame":
+        """Convert a table of the bulk grading view into scores (checkboxes become full or zero)."""
+        rubric = self.rubric
+        matrix = table[list(rubric.ids)].copy()
+        for i, key in enumerate(rubric.ids):
+            if rubric.types[i] == "full-or-zero":
+                matrix[key] = matrix[key].astype(bool) * rubric.max_scores[i]
+        return matrix.fillna(0).astype(int)
 
     def _on_download_click(self, include_json: bool):
         """
@@ -415,38 +615,44 @@ class GradingPage(AppPage):
             If True, include app-specific JSON files (detailed_grades.json, allocation.json) in the zip archive.
             If False, exclude these files from the archive (for PandA upload, etc).
         """
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # create temp directory (w/ or w/o app-specific JSON files)
-            for item in os.listdir(self.assignment_dir):
-                s = os.path.join(self.assignment_dir, item)
-                d = os.path.join(tmpdir, item)
-                if not include_json and item in [
-                    "detailed_grades.json",
-                    "allocation.json",
-                ]:
-                    continue
-                if os.path.isdir(s):
-                    shutil.copytree(s, d)
-                else:
-                    shutil.copy2(s, d)
-
-            # zip the temp directory
-            buffer = io.BytesIO()
-            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                for root, _, files in os.walk(tmpdir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, tmpdir)
-                        zip_file.write(file_path, arcname)
-
-            # donwload button
-            st.download_button(
-                label="zipファイルを取得",
-                data=buffer.getvalue(),
-                file_name=f"{os.path.basename(self.assignment_dir)}_{datetime.now().strftime('%m%d_%H%M')}.zip",
-                mime="application/zip",
-                type="primary",
-            )
+        # grades and comments queued for writing
+        write_behind = get_write_behind()
+        if not write_behind.flush(FLUSH_TIMEOUT):
+            st.error("保存先への書き込みが終わっていません。しばらく待ってから再度ダウンロードしてください。")
+            return
+        if write_behind.failed:
+            st.error("保存先に書き込めなかった変更があります。サイドバーから再試行してください。")
+            return
+        # merge the grades of all graders and write them before exporting
+        try:
+            self.grade_store.export(self.grader)
+        except WritesBlockedError as e:
+            st.error(str(e))
+            return
+        grades_csv = get_grades_csv(self.assignment_dir)
+        # assignments without grades.csv are exported without the totals
+        if self.rubric and os.path.exists(grades_csv.path):
+            try:
+                grades_csv.update_many(
+                    {s.split("(")[-1].rstrip(")"): self.rubric.total(v) for s, v in self.grade_store.to_dict().items()}
+                )
+            except ValueError as e:
+                st.error(str(e))
+        grades_csv.flush()
+        exclude = {SHARDS_DIR_NAME, LEGACY_JOURNAL_NAME}
+        if not include_json:
+            exclude |= {SNAPSHOT_NAME, "allocation.json"}
+        file_name = f"{os.path.basename(self.assignment_dir)}_{datetime.now().strftime('%m%d_%H%M')}.zip"
+        exports_dir = os.path.join(self.config["cache"]["dir"], "exports")
+        with st.spinner("zipファイルを作成中..."):
+            zip_path = write_export_zip(self.assignment_dir, exports_dir, file_name, exclude)
+
+        # donwload button (the file is streamed by the local file server)
+        st.link_button(
+            "zipファイルを取得",
+            file_url(zip_path, exports_dir, port=self.config["file_server"]["port"], download=True),
+            type="primary",
+        )
 
     @st.dialog("コメントを編集")
     def _on_edit_comment_click(self):
@@ -455,71 +661,82 @@ class GradingPage(AppPage):
             st.components.v1.html(self.comment_text, height=40, scrolling=True)
         self.comment_text = st.text_input("コメント", placeholder="ここにコメントを入力...")
         if st.button("保存"):
-            with open(
-                os.path.join(self.assignment_dir, self.selected_student, "comments.txt"),
-                "w",
-                encoding="utf-8",
-            ) as f:
-                f.write("<p>" + self.comment_text + "</p>")
+            student_dir = os.path.join(self.assignment_dir, self.selected_student)
+            comment = "<p>" + self.comment_text + "</p>"
+            path = os.path.join(student_dir, "comments.txt")
+            try:
+                with guarded_write(path):
+                    if write_behind_enabled(self.base_dir):
+                        # shown at once, and written to the save directory in the background
+                        self.prefetcher.set_comment(student_dir, comment)
+                        get_write_behind().submit(
+                            f"{self.selected_student} のコメント",
+                            write_text_atomic,
+                            path,
+                            comment,
+                            on_discard=lambda: self.prefetcher.invalidate(student_dir),
+                        )
+                    else:
+                        write_text_atomic(path, comment)
+            except WritesBlockedError as e:
+                st.error(str(e))
+                return
             st.success("コメントを保存しました！")
             st.rerun()
 
     def _on_next_click(self):
         if self.scores:
-            self._save_scores()
+            if not self._save_scores():
+                # stay on the student, so that the scores are not lost
+                return
             st.session_state["just_saved"] = True
         st.session_state["student_index"] = (st.session_state["student_index"] + 1) % len(self.students)
 
-    def _save_scores(self):
+    def _save_scores(self) -> bool:
         """
-        Callback function for saving the current scores to files.
+        Callback function for saving the current scores to files. Return False if they were not saved.
         """
-        # Save detailed grades to JSON (original file for this app)
-        grades_file = os.path.join(self.assignment_dir, "detailed_grades.json")
+        # the same scores for the near-duplicate answers, if requested
+        students = [self.selected_student]
+        if st.session_state.get(f"apply_to_cluster_{self.selected_student}"):
+            students += [s for s in self._cluster_of_selected() if s != self.selected_student]
+
+        # Save detailed grades to the journal of detailed_grades.json (original file for this app)
         try:
-            with open(grades_file, "r", encoding="utf-8") as gf:
-                data: dict[str, dict] = json.load(gf)
-        except FileNotFoundError:
-            data: dict[str, dict] = {}
-        data[self.selected_student] = self.scores
-        with open(grades_file, "w", encoding="utf-8") as gf:
-            json.dump(data, gf, ensure_ascii=False, indent=2)
+            self.grade_store.save_many({s: dict(self.scores) for s in students}, self.grader)
+        except WritesBlockedError as e:
+            st.error(str(e))
+            return False
 
         # Save overall grades to CSV (official file from PandA)
-        csv_path = os.path.join(self.assignment_dir, "grades.csv")
-        student_id = self.selected_student.split("(")[-1].rstrip(")")
-        lines = []
-        # load existing CSV data
-        with open(csv_path, "r", newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                lines.append(row)
-        # find the header row and check the column index for "成績"
+        total = self.rubric.total(self.scores)
         try:
-            header_idx = next(i for i, r in enumerate(lines) if r and r[0] == "学生番号")
-        except StopIteration:
-            st.error("grades.csv に '学生番号' ヘッダー行が見つかりません。ファイル形式を確認してください。")
-            return
-        header = lines[header_idx]
-        grade_idx = header.index("成績")
-        # update the score for the selected student
-        for i in range(header_idx + 1, len(lines)):
-            if lines[i] and lines[i][0] == student_id:
-                lines[i][grade_idx] = str(sum(self.scores.values()))
-                break
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerows(lines)
-
-    def _load_allocation(self, path: str):
-        alloc_file = os.path.join(path, "allocation.json")
-        if os.path.isfile(alloc_file):
-            with open(alloc_file, encoding="utf-8") as f:
-                return json.load(f)
-        return {}
+            get_grades_csv(self.assignment_dir).update_many({s.split("(")[-1].rstrip(")"): total for s in students})
+        except (ValueError, WritesBlockedError) as e:
+            st.error(str(e))
+        return True
+
+    def _cluster_of_selected(self) -> list[str]:
+        """Students with answers near-duplicate to that of the selected student, including the student."""
+        clustering = get_clustering(self.assignment_dir)
+        return clustering.cluster_of(self.selected_student) if clustering else []
+
+    def _local_copy(self, path: str) -> str:
+        """Return the local copy of a submission file, or the file itself if it cannot be copied."""
+        try:
+            return self.mirror.get(path)
+        except OSError:
+            return path
+
+    def _file_url(self, path: str, download: bool = False) -> str:
+        """Return the URL of a file under the base directory or its local copy, served by the local file server."""
+        mirror_dir = os.path.abspath(self.mirror.cache_dir)
+        root = mirror_dir if os.path.abspath(path).startswith(mirror_dir + os.sep) else self.base_dir
+        return file_url(path, root, port=self.config["file_server"]["port"], download=download)
 
 
 if __name__ == "__main__":
     st.set_page_config(page_title="提出物ビューア", layout="wide")
     app = GradingPage()
     app.render()
+    app.finish_rerun()
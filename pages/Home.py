@@ -1,11 +1,11 @@
-import io
 import os
-import shutil
-import zipfile
 
 import streamlit as st
 
 from pages.Page import AppPage
+from utils.dedup import dedup_attachments
+from utils.ingest import extract_zip, spool_upload
+from utils.search import refresh_async
 
 
 class HomePage(AppPage):
@@ -13,8 +13,9 @@ class HomePage(AppPage):
         super().__init__()
 
         os.makedirs(self.base_dir, exist_ok=True)
-        self.subjects = self._list_subdirs(self.base_dir)
-        self.assignments = {sbj: self._list_subdirs(os.path.join(self.base_dir, sbj)) for sbj in self.subjects}
+        with self.tracer.span("catalog"):
+            self.subjects = self.catalog.subjects()
+            self.assignments = self.catalog.assignments_by_subject()
 
         # initialize session states as None
         st.session_state.setdefault("need_allocation", False)
@@ -31,6 +32,12 @@ class HomePage(AppPage):
             title = st.session_state["uploaded_assignment"]
             st.toast(f"課題「{title}」を追加しました。", icon="✅")
             st.session_state["uploaded_assignment"] = None
+            dedup = st.session_state.pop("dedup_result", None)
+            if dedup and dedup.duplicates:
+                st.toast(
+                    f"重複した添付ファイル {len(dedup.duplicates)} 件を削除しました（{dedup.bytes_saved / 1024 / 1024:.1f} MB）。",
+                    icon="🧹",
+                )
 
     def render(self):
         """Create widgets for the home page."""
@@ -92,7 +99,14 @@ class HomePage(AppPage):
 
             # Decompress the zip file
             outdir = os.path.join(assignment_dir, assignment_name)
-            self.decompress_zip(zip_file, outdir)
+            progress = st.progress(0.0, text="展開中...")
+            self.decompress_zip(
+                zip_file,
+                outdir,
+                on_progress=lambda done, total, path: progress.progress(
+                    done / total, text=f"展開中 ({done}/{total}) : {os.path.basename(path)}"
+                ),
+            )
 
             st.session_state["subject"] = sbj_name
             st.session_state["assignment"] = assignment_name
@@ -123,16 +137,19 @@ class HomePage(AppPage):
             st.session_state["uploaded_assignment"] = assignment
             st.rerun()
 
-    def decompress_zip(self, zip_file, outdir):
+    def decompress_zip(self, zip_file, outdir, on_progress=None):
         """
-        Decompress a zip file into a subdirectory under assignment_dir named after the zip file (without extension).
+        Decompress a zip file into `outdir`.
 
         Parameters
         ----------
         zip_file : file-like object
             A file-like object representing the zip file to decompress.
-        assignment_dir : str
+        outdir : str
             The directory path where the contents of the zip file will be extracted.
+        on_progress : Callable[[int, int, str], None] | None
+            Called each time a file is extracted, with the number of extracted files,
+            the total number of files and the path of the extracted file.
 
         Returns
         -------
@@ -141,52 +158,34 @@ class HomePage(AppPage):
 
         Notes
         -----
+        - The upload is spooled to a temporary file and extracted by worker threads,
+          so memory use stays constant regardless of the archive size.
         - Skips hidden files and `__MACOSX` directories.
         - Attempts to decode filenames as UTF-8 to prevent garbled characters.
         - Removes the common top-level directory from extracted paths, if present.
+        - Removes attachments with identical content within each submission.
+        - Images are added to the image cache on background threads.
+        - HEIC images and office documents are converted into previews on background threads.
+        - Submitted texts and PDFs are added to the full-text index on a background thread.
         """
-        os.makedirs(outdir, exist_ok=True)
-
-        with zipfile.ZipFile(io.BytesIO(zip_file.read())) as zf:
-            # Detect the common prefix (top-level directory) in the zip file
-            names = [info.filename for info in zf.infolist() if not info.is_dir()]
-            common_prefix = os.path.commonprefix(names)
-            # Split by directory separator to avoid partial matches
-            if common_prefix and not common_prefix.endswith("/"):
-                common_prefix = os.path.dirname(common_prefix) + "/"
-
-            for info in zf.infolist():
-                # Skip __MACOSX and hidden files
-                if (
-                    info.filename.startswith("__MACOSX")
-                    or info.filename.startswith(".")
-                    or "/__MACOSX" in info.filename
-                    or "/." in info.filename
-                ):
-                    continue
-                if info.is_dir():
-                    continue
-                # Prevent garbled characters: decode as UTF-8 (cp437→utf-8)
-                try:
-                    filename = info.filename.encode("cp437").decode("utf-8")
-                except Exception:
-                    filename = info.filename
-                # Remove the common prefix
-                if common_prefix and filename.startswith(common_prefix):
-                    filename = filename[len(common_prefix) :]
-                if not filename:
-                    continue
-                # Swap the base directory with outdir
-                parts = filename.split(os.sep)
-                dest_path = os.path.join(outdir, *parts[1:])
-                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                with zf.open(info) as src, open(dest_path, "wb") as dst:
-                    shutil.copyfileobj(src, dst)
-
+        with self.tracer.span("extract_zip"), spool_upload(zip_file) as spool:
+            extracted = extract_zip(spool, outdir, on_progress=on_progress)
+        # remove attachments submitted more than once
+        with self.tracer.span("dedup"):
+            dedup = dedup_attachments(outdir)
+        st.session_state["dedup_result"] = dedup
+        # prepare images for the Grading page in the background
+        removed = set(dedup.duplicates)
+        kept = [path for path in extracted if path not in removed]
+        self.image_cache.prefetch(kept)
+        self.preview_cache.submit(kept)
+        refresh_async(self.search_index(outdir))
         return outdir
 
 
 if __name__ == "__main__":
     st.set_page_config(page_title="ホーム", layout="wide")
     home_page = HomePage()
-    home_page.render()
+    with home_page.tracer.span("render"):
+        home_page.render()
+    home_page.finish_rerun()
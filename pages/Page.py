@@ -1,32 +1,133 @@
+import copy
 import os
+import threading
 
+import streamlit as st
 import toml
 
+from utils.catalog import Catalog, get_catalog
+from utils.grade_store import default_grader
+from utils.image_cache import ImageCache, get_image_cache
+from utils.previews import PreviewCache, get_preview_cache
+from utils.profiling import Tracer
+from utils.search import AssignmentIndex, get_search_index
+from utils.storage import LocalMirror, cloud_provider, get_mirror
+
+# parsed config of each config file with its (mtime, size), shared by all reruns of the process
+_configs: dict[str, tuple[tuple, dict]] = {}
+_configs_lock = threading.Lock()
+
 
 class AppPage:
     """Defines common operations for all pages in the application.
     Current functionality includes loading configurations and listing subdirectories."""
 
     def __init__(self):
-        self.CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".streamlit", "config.toml")
+        # timing of the phases of this rerun
+        self.tracer = Tracer(type(self).__name__)
+        # the path can be overridden, e.g. to run benchmarks against a separate save directory
+        self.CONFIG_PATH = os.environ.get(
+            "TA_ASSISTANT_CONFIG",
+            os.path.join(os.path.dirname(os.path.dirname(__file__)), ".streamlit", "config.toml"),
+        )
         self.default_config = {
             "save": {"dir": os.path.join(os.getcwd(), "assignments")},
-            "window": {"grading_height": 740},
+            "window": {"grading_height": 740, "image_width": 1600},
+            "file_server": {"port": 8765},
+            "cache": {
+                "dir": os.path.join(os.path.expanduser("~"), ".cache", "ta-assistant"),
+                "image_max_mb": 1024,
+                "mirror_max_mb": 4096,
+            },
+            "debug": {"panel": False, "trace_file": ""},
+            "grader": {"name": ""},
         }
-        self.config = self.load_config()
+        with self.tracer.span("load_config"):
+            self.config = self.load_config()
         self.base_dir = self.config["save"]["dir"]
+        self.tracer.trace_file = self.config["debug"]["trace_file"] or None
 
     def load_config(self):
+        """
+        Return the config merged with the defaults.
+
+        The file is parsed once per process and again only when its mtime or size changes.
+        A copy is returned, since pages modify their config before saving it.
+        """
         if not os.path.exists(self.CONFIG_PATH):
             os.makedirs(os.path.dirname(self.CONFIG_PATH), exist_ok=True)
             with open(self.CONFIG_PATH, "w") as f:
                 toml.dump(self.default_config, f)
             return self.default_config
-        try:
-            curr_config = toml.load(self.CONFIG_PATH)
-            return self.merge_dicts(self.default_config, curr_config)
-        except Exception:
-            return self.default_config
+        stat = os.stat(self.CONFIG_PATH)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with _configs_lock:
+            cached = _configs.get(self.CONFIG_PATH)
+            if not cached or cached[0] != signature:
+                try:
+                    curr_config = toml.load(self.CONFIG_PATH)
+                    config = self.merge_dicts(self.default_config, curr_config)
+                except Exception:
+                    config = self.default_config
+                cached = _configs[self.CONFIG_PATH] = (signature, config)
+        return copy.deepcopy(cached[1])
+
+    @property
+    def catalog(self) -> Catalog:
+        """The cached listing of subjects, assignments and students under the base directory."""
+        return get_catalog(self.base_dir)
+
+    @property
+    def image_cache(self) -> ImageCache:
+        """The cache of images prepared for the Grading page."""
+        return get_image_cache(
+            os.path.join(self.config["cache"]["dir"], "images"),
+            self.config["cache"]["image_max_mb"] * 1024 * 1024,
+            self.config["window"]["image_width"],
+        )
+
+    @property
+    def preview_cache(self) -> PreviewCache:
+        """The cache of previews of HEIC images and office documents."""
+        return get_preview_cache(os.path.join(self.config["cache"]["dir"], "previews"))
+
+    @property
+    def mirror(self) -> LocalMirror:
+        """The local copies of submission files, used only if the base directory is synced by a cloud service."""
+        return get_mirror(
+            self.base_dir,
+            os.path.join(self.config["cache"]["dir"], "files"),
+            self.config["cache"]["mirror_max_mb"] * 1024 * 1024,
+            enabled=cloud_provider(self.base_dir) is not None,
+        )
+
+    def search_index(self, assignment_dir: str) -> AssignmentIndex:
+        """The full-text index of the submissions of an assignment."""
+        return get_search_index(os.path.join(self.config["cache"]["dir"], "search"), assignment_dir)
+
+    @property
+    def grader(self) -> str:
+        """Name of the grader recorded with saved scores, e.g. `alice@laptop` unless configured."""
+        return self.config["grader"]["name"] or default_grader()
+
+    def finish_rerun(self):
+        """Finish timing of this rerun and show the breakdown in the sidebar if the debug panel is enabled."""
+        spans = self.tracer.finish()
+        if not self.config["debug"]["panel"]:
+            return
+        with st.sidebar.expander("Rerun timing", icon=":material/timer:"):
+            st.markdown(f"**合計: {self.tracer.total_ms:.1f} ms**")
+            st.dataframe(
+                [
+                    {
+                        "phase": "\u3000" * s.depth + s.name,
+                        "start (ms)": round(s.start_ms, 1),
+                        "duration (ms)": round(s.duration_ms, 1),
+                    }
+                    for s in spans
+                ],
+                hide_index=True,
+            )
 
     def merge_dicts(self, default: dict, override: dict) -> dict:
         """
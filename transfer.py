@@ -1,26 +1,21 @@
+import argparse
+import hashlib
+import json
 import os
-import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
 
-def transfer_to_excel(csv_df: pd.DataFrame, xlsx_df: pd.DataFrame, title: str):
-    # Transfer grades using student ID as the key
-    # Convert both to str because student ID in CSV is str, but in Excel it may be int
-    csv_df["学生番号"] = csv_df["学生番号"].astype(str)
-    xlsx_df["学生番号"] = xlsx_df["学生番号"].astype(str)
-
-    # Create a mapping dictionary for grades only
-    score_map = csv_df.set_index("学生番号")["成績"].to_dict()
-
-    # Add a new column (assignment) to xlsx_df
-    xlsx_df[title] = xlsx_df["学生番号"].map(score_map)
-
-    # Overwrite the original Excel file with the updated xlsx_df
-    xlsx_df.to_excel(xlsx_path, index=False)
-
+def read_grades(assignment_dir: str) -> pd.Series | None:
+    """
+    Read the grades of an assignment from its `grades.csv`.
 
-def main(assignment_dir: str, xlsx_df: pd.DataFrame):
+    Returns
+    -------
+    pd.Series | None
+        Grades indexed by student ID, or None if the assignment has no `grades.csv`.
+    """
     try:
         csv_df = pd.read_csv(
             os.path.join(assignment_dir, "grades.csv"),
@@ -30,23 +25,142 @@ def main(assignment_dir: str, xlsx_df: pd.DataFrame):
         )
     except FileNotFoundError:
         print(f"File not found: {os.path.join(assignment_dir, 'grades.csv')}, skipping this assignment.")
-        return
-    transfer_to_excel(csv_df, xlsx_df, title=os.path.basename(assignment_dir))
+        return None
+    return csv_df.set_index("学生番号")["成績"]
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python transfer.py <subject_folder> <xlsx_path>")
-        sys.exit(1)
-    subject_folder = sys.argv[1]
-    xlsx_path = sys.argv[2]
+def transfer_to_excel(grades: dict[str, pd.Series], xlsx_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Join the grades of all assignments onto the roster, using student ID as the key.
+
+    Parameters
+    ----------
+    grades : dict[str, pd.Series]
+        Grades of each assignment (title → grades indexed by student ID).
+    xlsx_df : pd.DataFrame
+        The roster with the column `学生番号`.
+
+    Returns
+    -------
+    pd.DataFrame
+        The roster with one column per assignment. Existing columns of the same titles are replaced in place,
+        and new ones are appended.
+    """
+    # Convert to str because student ID in CSV is str, but in Excel it may be int
+    xlsx_df = xlsx_df.copy()
+    xlsx_df["学生番号"] = xlsx_df["学生番号"].astype(str)
+    grades = {title: s[~s.index.duplicated()] for title, s in grades.items()}
+    # existing columns are replaced in place, so that the order of the roster columns is kept
+    for title in [t for t in grades if t in xlsx_df.columns]:
+        xlsx_df[title] = xlsx_df["学生番号"].map(grades.pop(title))
+    if not grades:
+        return xlsx_df
+    grades_df = pd.concat(grades, axis=1)
+    return xlsx_df.merge(grades_df, how="left", left_on="学生番号", right_index=True)
+
+
+def report_mismatches(grades: dict[str, pd.Series], xlsx_df: pd.DataFrame):
+    """Print students of the roster missing from each assignment, and students not found in the roster."""
+    roster_ids = set(xlsx_df["学生番号"].astype(str))
+    for title, s in grades.items():
+        csv_ids = set(s.index.astype(str))
+        missing = sorted(roster_ids - csv_ids)
+        unmatched = sorted(csv_ids - roster_ids)
+        if missing:
+            print(f"[{title}] {len(missing)} students in the roster are missing from grades.csv: {missing}")
+        if unmatched:
+            print(f"[{title}] {len(unmatched)} students in grades.csv are not in the roster: {unmatched}")
+
+
+def file_signature(path: str, previous: dict | None = None) -> dict:
+    """
+    Return the mtime, size and content hash of a file.
+    The hash is reused from `previous` if the mtime and size are unchanged.
+    """
+    stat = os.stat(path)
+    signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    if previous and all(previous.get(k) == v for k, v in signature.items()):
+        signature["sha256"] = previous["sha256"]
+        return signature
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    signature["sha256"] = h.hexdigest()
+    return signature
+
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main(subject_folder: str, xlsx_path: str, sidecar_path: str | None = None, full: bool = False):
+    """
+    Transfer grades of the assignments under `subject_folder` into the roster `xlsx_path`.
+
+    A manifest next to the roster records the signature of each `grades.csv`.
+    Only assignments whose grades changed since the last run are merged, unless `full` is True.
+    """
     xlsx_df = pd.read_excel(xlsx_path)
+    manifest_path = os.path.splitext(xlsx_path)[0] + ".manifest.json"
+    manifest = {} if full else load_manifest(manifest_path)
+
+    # List all assignment directories with grades.csv (ignore hidden files/folders)
+    assignment_dirs = [
+        os.path.join(subject_folder, d)
+        for d in sorted(os.listdir(subject_folder))
+        if not d.startswith(".") and os.path.isfile(os.path.join(subject_folder, d, "grades.csv"))
+    ]
+    signatures = {}
+    changed = []
+    for d in assignment_dirs:
+        title = os.path.basename(d)
+        signatures[title] = file_signature(os.path.join(d, "grades.csv"), manifest.get(title))
+        previous = manifest.get(title, {})
+        if previous.get("sha256") != signatures[title]["sha256"] or title not in xlsx_df.columns:
+            changed.append(d)
+    if not changed and (not sidecar_path or os.path.exists(sidecar_path)):
+        print("No changes in grades.")
+        return
 
-    # List all assignment directories (ignore hidden files/folders)
-    assignment_dirs = [dir for dir in sorted(os.listdir(subject_folder)) if not dir.startswith(".")]
-    for assignment_dir in assignment_dirs:
-        print(f"Processing assignment: {assignment_dir}")
-        path = os.path.join(subject_folder, assignment_dir)
-        main(path, xlsx_df)
+    # Read grades.csv of the changed assignments concurrently
+    with ThreadPoolExecutor() as pool:
+        results = list(pool.map(read_grades, changed))
+    grades = {os.path.basename(d): s for d, s in zip(changed, results) if s is not None}
+    for title in grades:
+        print(f"Processing assignment: {title}")
+
+    report_mismatches(grades, xlsx_df)
+    # Overwrite the original Excel file once with all assignments
+    xlsx_df = transfer_to_excel(grades, xlsx_df)
+    xlsx_df.to_excel(xlsx_path, index=False)
+    if sidecar_path:
+        write_sidecar(xlsx_df, sidecar_path)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(signatures, f, ensure_ascii=False, indent=2)
+
+
+def write_sidecar(df: pd.DataFrame, path: str):
+    """Write the gradebook in a columnar format (Parquet or Feather, chosen by the extension)."""
+    # object columns may mix str and numbers, which columnar formats do not allow
+    df = df.astype({c: str for c in df.columns if df[c].dtype == object})
+    if path.endswith(".feather"):
+        df.to_feather(path)
+    else:
+        df.to_parquet(path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transfer grades of all assignments of a subject into a roster.")
+    parser.add_argument("subject_folder", help="folder of the subject containing assignment folders")
+    parser.add_argument("xlsx_path", help="Excel roster with the column 学生番号")
+    parser.add_argument("--sidecar", help="also write the gradebook to this .parquet or .feather file")
+    parser.add_argument("--full", action="store_true", help="merge all assignments, ignoring the manifest")
+    args = parser.parse_args()
+    main(args.subject_folder, args.xlsx_path, sidecar_path=args.sidecar, full=args.full)
 
     print("Successfully transferred!")
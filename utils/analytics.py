@@ -0,0 +1,146 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from utils.assignment_state import AssignmentState, get_assignment_state
+from utils.catalog import Catalog
+from utils.rubric import Rubric, RubricError
+
+
+@dataclass(frozen=True, eq=False)
+class ScoreMatrix:
+    """
+    Scores of an assignment as a matrix of students (rows) by rubric items (columns).
+
+    Ungraded students are NaN rows, so every statistic is computed column-wise over graded students only.
+    """
+
+    rubric: Rubric
+    students: tuple[str, ...]  # names of student directories (`Name(ID)`)
+    scores: np.ndarray  # float, shape (len(students), len(rubric))
+
+    @property
+    def graded(self) -> np.ndarray:
+        """Boolean mask of the students who have been graded."""
+        return ~np.isnan(self.scores).all(axis=1) if len(self.rubric) else np.zeros(len(self.students), bool)
+
+    def totals(self) -> pd.Series:
+        """Total scores of the graded students."""
+        graded = self.graded
+        return pd.Series(
+            np.nansum(self.scores[graded], axis=1), index=np.array(self.students, dtype=object)[graded], name="合計"
+        )
+
+    def item_summary(self) -> pd.DataFrame:
+        """Per-item statistics: full-score rate, mean, mean rate against the allocated score and graded count."""
+        scores = self.scores[self.graded]
+        max_scores = np.array(self.rubric.max_scores, dtype=float)
+        count = (~np.isnan(scores)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            full = (scores == max_scores).sum(axis=0) / count
+            mean = np.nansum(scores, axis=0) / count
+            rate = np.where(max_scores > 0, mean / max_scores, np.nan)
+        return pd.DataFrame(
+            {"配点": self.rubric.max_scores, "満点率": full, "平均点": mean, "得点率": rate, "採点済み": count},
+            index=pd.Index(self.rubric.ids, name="項目"),
+        )
+
+    def histogram(self, item: str) -> pd.Series:
+        """Number of graded students for each score from 0 to the allocated score of the item."""
+        i = self.rubric.ids.index(item)
+        column = self.scores[:, i]
+        column = column[~np.isnan(column)].astype(int)
+        max_score = self.rubric.max_scores[i]
+        counts = np.bincount(np.clip(column, 0, max_score), minlength=max_score + 1)
+        return pd.Series(counts, index=pd.RangeIndex(max_score + 1, name="得点"), name="人数")
+
+    def total_histogram(self) -> pd.Series:
+        """Number of graded students for each total score from 0 to the maximum total."""
+        totals = self.totals().to_numpy().astype(int)
+        max_total = self.rubric.max_total
+        counts = np.bincount(np.clip(totals, 0, max_total), minlength=max_total + 1)
+        return pd.Series(counts, index=pd.RangeIndex(max_total + 1, name="合計得点"), name="人数")
+
+
+def build_score_matrix(rubric: Rubric, students: list[str], grades: dict[str, dict]) -> ScoreMatrix:
+    """Arrange detailed grades into a `ScoreMatrix` following the order of the rubric items."""
+    column = {key: j for j, key in enumerate(rubric.ids)}
+    scores = np.full((len(students), len(rubric)), np.nan)
+    for i, student in enumerate(students):
+        for key, value in grades.get(student, {}).items():
+            j = column.get(key)
+            if j is not None:
+                scores[i, j] = value
+    return ScoreMatrix(rubric, tuple(students), scores)
+
+
+_matrices: dict[str, tuple[tuple, ScoreMatrix]] = {}
+_matrices_lock = threading.Lock()
+
+
+def get_score_matrix(state: AssignmentState) -> ScoreMatrix | None:
+    """
+    Return the `ScoreMatrix` of the assignment, or None if the allocation is not defined yet.
+
+    The matrix is rebuilt only when the rubric, the list of students or the grades have changed.
+
+    Raises
+    ------
+    RubricError
+        If `allocation.json` is not a valid rubric.
+    """
+    rubric = state.rubric
+    if rubric is None:
+        return None
+    students = tuple(state.students)
+    key = (rubric, students, state.grades.version)
+    with _matrices_lock:
+        cached = _matrices.get(state.assignment_dir)
+    if cached and cached[0] == key:
+        return cached[1]
+    matrix = build_score_matrix(rubric, list(students), state.grades.to_dict())
+    with _matrices_lock:
+        _matrices[state.assignment_dir] = (key, matrix)
+    return matrix
+
+
+def get_subject_matrices(catalog: Catalog, subject: str) -> dict[str, ScoreMatrix]:
+    """Return the `ScoreMatrix` of every assignment of the subject with a valid allocation."""
+    matrices = {}
+    for assignment in catalog.assignments(subject):
+        try:
+            matrix = get_score_matrix(get_assignment_state(catalog, subject, assignment))
+        except RubricError:
+            continue
+        if matrix is not None:
+            matrices[assignment] = matrix
+    return matrices
+
+
+def assignment_summary(matrices: dict[str, ScoreMatrix]) -> pd.DataFrame:
+    """Distribution of the total scores of each assignment."""
+    rows = {}
+    for assignment, matrix in matrices.items():
+        totals = matrix.totals()
+        rows[assignment] = {
+            "満点": matrix.rubric.max_total,
+            "採点済み": len(totals),
+            "学生数": len(matrix.students),
+            "平均点": totals.mean(),
+            "中央値": totals.median(),
+            "標準偏差": totals.std(),
+            "得点率": totals.mean() / matrix.rubric.max_total if matrix.rubric.max_total else np.nan,
+        }
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis("課題")
+
+
+def subject_total_histogram(matrices: dict[str, ScoreMatrix], bins: int = 20) -> pd.Series:
+    """Number of students for each range of the total score summed over the assignments of a subject."""
+    totals = [m.totals().rename(lambda s: s.split("(")[-1].rstrip(")")) for m in matrices.values()]
+    summed = pd.concat(totals, axis=1).sum(axis=1).to_numpy() if totals else np.array([])
+    max_total = sum(m.rubric.max_total for m in matrices.values())
+    counts, edges = np.histogram(summed, bins=max(min(bins, max_total), 1), range=(0, max(max_total, 1)))
+    # labelled by the lower end of each range
+    return pd.Series(counts, index=pd.Index(edges[:-1].round().astype(int), name="合計得点"), name="人数")
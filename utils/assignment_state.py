@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+
+from utils.catalog import Catalog
+from utils.grade_store import GradeStore, get_grade_store
+from utils.rubric import Rubric, compile_rubric
+
+ALLOCATION_NAME = "allocation.json"
+
+
+class AssignmentState:
+    """
+    Data of an assignment shared across reruns and sessions.
+
+    Files are parsed only when their mtime changes, so a rerun without changes on disk does no JSON parsing.
+    """
+
+    def __init__(self, catalog: Catalog, subject: str, assignment: str):
+        self.catalog = catalog
+        self.subject = subject
+        self.assignment = assignment
+        self.assignment_dir = os.path.join(catalog.base_dir, subject, assignment)
+        self.grades: GradeStore = get_grade_store(self.assignment_dir)
+        self._lock = threading.Lock()
+        self._allocation: dict = {}
+        self._allocation_mtime = None
+        self._rubric: tuple[int, Rubric] | None = None
+
+    @property
+    def allocation(self) -> dict:
+        """Contents of `allocation.json`, or an empty dict if it is not defined yet."""
+        path = os.path.join(self.assignment_dir, ALLOCATION_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if mtime != self._allocation_mtime:
+                with open(path, encoding="utf-8") as f:
+                    self._allocation = json.load(f)
+                self._allocation_mtime = mtime
+            return self._allocation
+
+    @property
+    def rubric(self) -> Rubric | None:
+        """
+        The allocation compiled into a `Rubric`, or None if it is not defined yet.
+
+        Raises
+        ------
+        RubricError
+            If `allocation.json` is not a valid rubric.
+        """
+        allocation = self.allocation
+        if not allocation:
+            return None
+        with self._lock:
+            if self._rubric is None or self._rubric[0] != self._allocation_mtime:
+                self._rubric = (self._allocation_mtime, compile_rubric(allocation))
+            return self._rubric[1]
+
+    @property
+    def students(self) -> list[str]:
+        """Names of student directories (`Name(ID)`)."""
+        return self.catalog.students(self.subject, self.assignment)
+
+    @property
+    def graded_count(self) -> int:
+        return len(self.grades)
+
+    @property
+    def total_count(self) -> int:
+        return len(self.students)
+
+
+_states: dict[tuple[str, str, str], AssignmentState] = {}
+_states_lock = threading.Lock()
+
+
+def get_assignment_state(catalog: Catalog, subject: str, assignment: str) -> AssignmentState:
+    """Return the process-wide `AssignmentState` of the assignment."""
+    key = (catalog.base_dir, subject, assignment)
+    with _states_lock:
+        if key not in _states:
+            _states[key] = AssignmentState(catalog, subject, assignment)
+        return _states[key]
@@ -0,0 +1,85 @@
+import os
+import threading
+
+ATTACHMENTS_DIR_NAME = "提出物の添付ファイル"
+
+
+class Catalog:
+    """
+    Process-wide listing of subjects → assignments → students under the base directory.
+
+    Each directory listing is cached together with the mtime of the directory, which changes whenever
+    an entry is added, removed or renamed. A lookup therefore costs a single `stat` instead of listing
+    the directory and checking every entry.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self._listings: dict[str, tuple[int, list[str]]] = {}
+
+    def subjects(self) -> list[str]:
+        """Return the sorted names of subjects."""
+        return self._subdirs(self.base_dir)
+
+    def assignments(self, subject: str) -> list[str]:
+        """Return the sorted names of assignments of the subject."""
+        return self._subdirs(os.path.join(self.base_dir, subject))
+
+    def assignments_by_subject(self) -> dict[str, list[str]]:
+        """Return the names of assignments of every subject."""
+        return {sbj: self.assignments(sbj) for sbj in self.subjects()}
+
+    def students(self, subject: str, assignment: str) -> list[str]:
+        """Return the sorted names of student directories (`Name(ID)`) of the assignment."""
+        return self._subdirs(os.path.join(self.base_dir, subject, assignment))
+
+    def student_signature(self, subject: str, assignment: str, student: str) -> tuple:
+        """
+        Modification times of the student directory and its attachments directory.
+
+        They change whenever a file is added, removed or replaced by renaming, which is how the ingest
+        writes files, so derived data only needs to be checked again for students whose signature changed.
+        """
+        student_dir = os.path.join(self.base_dir, subject, assignment, student)
+        signature = []
+        for path in (student_dir, os.path.join(student_dir, ATTACHMENTS_DIR_NAME)):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def invalidate(self):
+        """Forget all cached listings."""
+        with self._lock:
+            self._listings.clear()
+
+    def _subdirs(self, path: str) -> list[str]:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            cached = self._listings.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with os.scandir(path) as it:
+            # hidden directories hold data of the app, e.g. the journals of graders
+            subdirs = sorted(entry.name for entry in it if entry.is_dir() and not entry.name.startswith("."))
+        with self._lock:
+            self._listings[path] = (mtime, subdirs)
+        return subdirs
+
+
+_catalogs: dict[str, Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(base_dir: str) -> Catalog:
+    """Return the process-wide `Catalog` of the base directory."""
+    key = os.path.abspath(base_dir)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = Catalog(key)
+        return _catalogs[key]
@@ -0,0 +1,145 @@
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import cache
+from typing import TYPE_CHECKING
+
+from utils.search import AssignmentIndex
+
+if TYPE_CHECKING:
+    import numpy as np
+
+SHINGLE_SIZE = 5  # characters, since Japanese answers are not separated by spaces
+NUM_PERM = 128
+BANDS = 16  # NUM_PERM = BANDS * rows; candidates share a band with probability 1 - (1 - s^8)^16
+SIMILARITY_THRESHOLD = 0.8  # estimated Jaccard similarity for answers to be in the same cluster
+# Texts per task submitted to the process pool
+CHUNK_SIZE = 64
+_PRIME = (1 << 32) - 5
+
+
+@cache
+def _permutations() -> tuple["np.ndarray", "np.ndarray"]:
+    """
+    Coefficients `(a, b)` of the hash functions, drawn with a fixed seed so that every process uses the same.
+
+    NumPy is imported on first use, so that the Grading page loads without it until clustering is run.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(20240401)
+    return rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64), rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str) -> "np.ndarray":
+    """Return the CRC32 hashes of the character shingles of the text, ignoring whitespace."""
+    import numpy as np
+
+    text = "".join(text.split())
+    if len(text) < SHINGLE_SIZE:
+        return np.array([zlib.crc32(text.encode("utf-8"))] if text else [], dtype=np.uint64)
+    grams = {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash_signatures(texts: list[str]) -> "np.ndarray":
+    """
+    Return the MinHash signatures of the texts, of shape (len(texts), NUM_PERM).
+
+    Module-level so that it can be run in worker processes.
+    """
+    import numpy as np
+
+    a, b = _permutations()
+    signatures = np.full((len(texts), NUM_PERM), _PRIME, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = shingles(text)
+        if len(hashes):
+            # (a * x + b) mod p for every permutation and shingle; fits in uint64 as a, x, b < 2^32
+            signatures[i] = ((np.outer(hashes, a) + b) % _PRIME).min(axis=0)
+    return signatures
+
+
+@dataclass
+class Clustering:
+    """Groups of students with near-duplicate answers, largest first."""
+
+    clusters: list[list[str]]
+    _by_student: dict[str, int] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._by_student = {s: i for i, cluster in enumerate(self.clusters) for s in cluster}
+
+    def cluster_of(self, student: str) -> list[str]:
+        """Return the students in the same cluster as the student (including the student), or an empty list."""
+        i = self._by_student.get(student)
+        return self.clusters[i] if i is not None else []
+
+
+def cluster_texts(texts: dict[str, str], max_workers: int | None = None) -> Clustering:
+    """
+    Group near-duplicate texts with MinHash and locality sensitive hashing.
+
+    Signatures are computed in a process pool. Texts sharing an LSH bucket are compared with the first text
+    of the bucket only, so the cost stays linear in the number of texts even if most answers are identical.
+
+    Parameters
+    ----------
+    texts : dict[str, str]
+        Text of each student. Empty texts are ignored.
+    max_workers : int | None
+        Number of worker processes. Signatures are computed in this process for small classes.
+    """
+    import numpy as np
+
+    students = [s for s, t in texts.items() if t.strip()]
+    chunks = [[texts[s] for s in students[i : i + CHUNK_SIZE]] for i in range(0, len(students), CHUNK_SIZE)]
+    if len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            parts = list(pool.map(minhash_signatures, chunks))
+    else:
+        parts = [minhash_signatures(c) for c in chunks]
+    signatures = np.concatenate(parts) if parts else np.zeros((0, NUM_PERM), dtype=np.uint64)
+
+    parent = list(range(len(students)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = NUM_PERM // BANDS
+    for band in range(BANDS):
+        buckets: dict[bytes, int] = {}
+        for i, key in enumerate(signatures[:, band * rows : (band + 1) * rows]):
+            first = buckets.setdefault(key.tobytes(), i)
+            if first != i and find(first) != find(i):
+                if np.mean(signatures[first] == signatures[i]) >= SIMILARITY_THRESHOLD:
+                    parent[find(i)] = find(first)
+
+    groups: dict[int, list[str]] = {}
+    for i, student in enumerate(students):
+        groups.setdefault(find(i), []).append(student)
+    clusters = sorted((sorted(g) for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), g[0]))
+    return Clustering(clusters)
+
+
+_clusterings: dict[str, Clustering] = {}
+_clusterings_lock = threading.Lock()
+
+
+def cluster_assignment(index: AssignmentIndex) -> Clustering:
+    """Cluster the submissions of the assignment by the texts of its search index and keep the result."""
+    clustering = cluster_texts(index.texts())
+    with _clusterings_lock:
+        _clusterings[index.assignment_dir] = clustering
+    return clustering
+
+
+def get_clustering(assignment_dir: str) -> Clustering | None:
+    """Return the last clustering of the assignment in this process, or None if it has not been run."""
+    with _clusterings_lock:
+        return _clusterings.get(os.path.abspath(assignment_dir))
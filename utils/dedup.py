@@ -0,0 +1,104 @@
+import argparse
+import hashlib
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from utils.catalog import ATTACHMENTS_DIR_NAME
+
+# Copies created by PandA for re-submitted files, e.g. "report+1.pdf"
+COPY_PATTERN = re.compile(r"\+\d+(\.[^.]+)?$")
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class DedupResult:
+    """Files which were removed (or replaced by hard links) as duplicates."""
+
+    duplicates: list[str] = field(default_factory=list)
+    bytes_saved: int = 0
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _keep_order(path: str):
+    """Prefer the original file over its `+N` copies, then the shortest name."""
+    name = os.path.basename(path)
+    return (bool(COPY_PATTERN.search(name)), len(name), name)
+
+
+def dedup_attachments(root: str, hardlink: bool = False, max_workers: int | None = None) -> DedupResult:
+    """
+    Remove duplicated attachments within each submission under `root`.
+
+    Files are compared by content: only files of the same extension and size are hashed (in parallel),
+    and a `+N` copy whose content differs from the original is kept.
+
+    Parameters
+    ----------
+    root : str
+        Directory to search for `提出物の添付ファイル` directories, e.g. an assignment directory.
+    hardlink : bool
+        If True, duplicates are replaced by hard links to the kept file instead of being deleted.
+    max_workers : int | None
+        Number of threads used for hashing.
+
+    Returns
+    -------
+    DedupResult
+        The duplicated files and the number of bytes saved.
+    """
+    # group files of the same extension and size within each submission
+    candidates: dict[tuple[str, str, int], list[str]] = defaultdict(list)
+    for dirpath, _, filenames in os.walk(root):
+        if os.path.basename(dirpath) != ATTACHMENTS_DIR_NAME:
+            continue
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                ext = os.path.splitext(name)[1].lower()
+                candidates[(dirpath, ext, os.path.getsize(path))].append(path)
+    to_hash = [path for paths in candidates.values() if len(paths) > 1 for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        hashes = dict(zip(to_hash, pool.map(_hash_file, to_hash)))
+
+    result = DedupResult()
+    for (_, _, size), paths in candidates.items():
+        groups: dict[str, list[str]] = defaultdict(list)
+        for path in paths:
+            if path in hashes:
+                groups[hashes[path]].append(path)
+        for same in groups.values():
+            keep, *duplicates = sorted(same, key=_keep_order)
+            for path in duplicates:
+                if hardlink:
+                    if os.path.samefile(keep, path):
+                        continue
+                    tmp_path = path + ".tmp"
+                    os.link(keep, tmp_path)
+                    os.replace(tmp_path, path)
+                else:
+                    os.remove(path)
+                result.duplicates.append(path)
+                result.bytes_saved += size
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicated attachments of submissions.")
+    parser.add_argument("root", help="directory containing submissions, e.g. an assignment directory")
+    parser.add_argument("--hardlink", action="store_true", help="replace duplicates with hard links")
+    args = parser.parse_args()
+    result = dedup_attachments(args.root, hardlink=args.hardlink)
+    for path in result.duplicates:
+        print(f"{'Linked' if args.hardlink else 'Deleted'}: {path}")
+    action = "ハードリンクに置き換え" if args.hardlink else "削除"
+    print(f"✅ 合計 {len(result.duplicates)} 件の複製ファイルを{action}ました。({result.bytes_saved / 1024 / 1024:.1f} MB)")
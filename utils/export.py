@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Formats which are already compressed and are stored in the archive as they are
+STORED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".heic", ".webp", ".gif", ".zip", ".docx", ".xlsx", ".pptx")
+# Files smaller than this are read ahead by worker threads, larger ones are streamed by the writer
+READ_AHEAD_SIZE = 8 * 1024 * 1024
+# Number of files read ahead at the same time
+READ_AHEAD_COUNT = 8
+# Exports older than this (in seconds) are removed when a new one is created
+EXPORT_TTL = 60 * 60
+
+
+def _is_private(name: str) -> bool:
+    """Whether a file is never exported: hidden files (e.g. `.grades`) and temporaries of interrupted writes."""
+    return name.startswith(".") or name.endswith(".tmp")
+
+
+def list_export_files(assignment_dir: str, exclude: set[str]) -> list[tuple[str, str]]:
+    """
+    List the files to include in the exported archive.
+
+    Parameters
+    ----------
+    assignment_dir : str
+        The assignment directory to export.
+    exclude : set[str]
+        Names of top-level files or directories to leave out, e.g. `detailed_grades.json`.
+        Hidden files and directories and `*.tmp` files are left out at every level.
+
+    Returns
+    -------
+    list[tuple[str, str]]
+        Pairs of a file path and its name in the archive.
+    """
+    files = []
+    for item in sorted(os.listdir(assignment_dir)):
+        if item in exclude or _is_private(item):
+            continue
+        path = os.path.join(assignment_dir, item)
+        if os.path.isdir(path):
+            for root, dirnames, names in os.walk(path):
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for name in sorted(n for n in names if not _is_private(n)):
+                    file_path = os.path.join(root, name)
+                    files.append((file_path, os.path.relpath(file_path, assignment_dir)))
+        else:
+            files.append((path, item))
+    return files
+
+
+def _read_small(path: str) -> bytes | None:
+    if os.path.getsize(path) > READ_AHEAD_SIZE:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_export_zip(assignment_dir: str, exports_dir: str, file_name: str, exclude: set[str]) -> str:
+    """
+    Write the assignment directory into a zip file directly, without copying it first.
+
+    Already compressed formats (`STORED_EXTENSIONS`) are stored without recompression and the other files
+    are deflated. Small files are read by worker threads ahead of the writer, which hides the latency of
+    cloud-synced folders.
+
+    Parameters
+    ----------
+    assignment_dir : str
+        The assignment directory to export.
+    exports_dir : str
+        Directory where the archive is created. Old exports in it are removed.
+    file_name : str
+        File name of the archive.
+    exclude : set[str]
+        Names of top-level files or directories to leave out.
+
+    Returns
+    -------
+    str
+        Path of the created archive.
+    """
+    os.makedirs(exports_dir, exist_ok=True)
+    # remove exports which were already downloaded
+    for entry in os.scandir(exports_dir):
+        if entry.is_dir() and time.time() - entry.stat().st_mtime > EXPORT_TTL:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    zip_path = os.path.join(tempfile.mkdtemp(dir=exports_dir), file_name)
+    files = list_export_files(assignment_dir, exclude)
+    with ThreadPoolExecutor(max_workers=READ_AHEAD_COUNT) as pool, zipfile.ZipFile(zip_path, "w") as zf:
+        # keep at most READ_AHEAD_COUNT files in flight to bound memory use
+        window = deque()
+        for path, arcname in files:
+            window.append((path, arcname, pool.submit(_read_small, path)))
+            if len(window) > READ_AHEAD_COUNT:
+                _write_entry(zf, *window.popleft())
+        while window:
+            _write_entry(zf, *window.popleft())
+    return zip_path
+
+
+def _write_entry(zf: zipfile.ZipFile, path: str, arcname: str, content: Future):
+    data = content.result()
+    compress_type = zipfile.ZIP_STORED if path.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+    if data is None:
+        zf.write(path, arcname, compress_type=compress_type)
+    else:
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+        zinfo.compress_type = compress_type
+        zf.writestr(zinfo, data)
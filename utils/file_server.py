@@ -0,0 +1,180 @@
+import hashlib
+import mimetypes
+import os
+import secrets
+import threading
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+HOST = "127.0.0.1"
+CHUNK_SIZE = 1024 * 1024
+CACHE_CONTROL = "private, max-age=86400"
+
+
+class _FileRequestHandler(BaseHTTPRequestHandler):
+    """Serves files under the registered roots with support for Range and conditional requests."""
+
+    server: "FileServer"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self, send_body: bool):
+        url = urlsplit(self.path)
+        path = self.server.resolve(unquote(url.path))
+        if path is None or not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.end_headers()
+            return
+
+        # parse a single byte range, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-1024"
+        start, end = 0, size - 1
+        status = HTTPStatus.OK
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            try:
+                unit, spec = range_header.split("=", 1)
+                if unit.strip() != "bytes" or "," in spec:
+                    raise ValueError
+                first, last = spec.strip().split("-", 1)
+                if first:
+                    start = int(first)
+                    end = min(int(last), size - 1) if last else size - 1
+                else:
+                    start = max(size - int(last), 0)
+                if start > end or start >= size:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+                status = HTTPStatus.PARTIAL_CONTENT
+            except ValueError:
+                # ignore malformed or multiple ranges and send the whole file
+                start, end = 0, size - 1
+
+        self.send_response(status)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        disposition = "attachment" if "download" in parse_qs(url.query) else "inline"
+        self.send_header("Content-Disposition", f"{disposition}; filename*=UTF-8''{quote(os.path.basename(path))}")
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # the browser cancelled the request (e.g. after reading the ranges it needs)
+                pass
+
+
+class FileServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for submission files.
+
+    URLs have the form `/<secret>/<root token>/<relative path>`. The secret is generated per process,
+    so that other web pages cannot guess the URLs of the files.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int):
+        try:
+            super().__init__((HOST, port), _FileRequestHandler)
+        except OSError:
+            # fall back to an ephemeral port if the configured one is in use
+            super().__init__((HOST, 0), _FileRequestHandler)
+        self.secret = secrets.token_urlsafe(16)
+        self.roots: dict[str, str] = {}
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def register_root(self, root: str) -> str:
+        """Allow serving files under `root` and return its token."""
+        root = os.path.realpath(root)
+        token = hashlib.sha1(root.encode("utf-8")).hexdigest()[:12]
+        self.roots[token] = root
+        return token
+
+    def resolve(self, url_path: str) -> str | None:
+        """Translate a URL path into a file path, or None if it is not under a registered root."""
+        parts = url_path.lstrip("/").split("/", 2)
+        if len(parts) != 3 or parts[0] != self.secret or parts[1] not in self.roots:
+            return None
+        root = self.roots[parts[1]]
+        path = os.path.realpath(os.path.join(root, parts[2]))
+        if not path.startswith(root + os.sep):
+            return None
+        return path
+
+
+_server: FileServer | None = None
+_server_lock = threading.Lock()
+
+
+def get_file_server(port: int = 0) -> FileServer:
+    """Return the process-wide `FileServer`, starting it on the first call."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = FileServer(port)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def file_url(path: str, root: str, port: int = 0, download: bool = False) -> str:
+    """
+    Return a URL from which the browser can fetch the file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to serve.
+    root : str
+        Directory containing the file. Only files under registered roots are served.
+    port : int
+        Port of the server, used only when the server is not running yet. 0 means an ephemeral port.
+    download : bool
+        If True, the browser saves the file instead of displaying it.
+
+    Returns
+    -------
+    str
+        URL of the file.
+    """
+    server = get_file_server(port)
+    token = server.register_root(root)
+    rel_path = os.path.relpath(os.path.realpath(path), server.roots[token])
+    url = f"http://{HOST}:{server.port}/{server.secret}/{token}/{quote(rel_path.replace(os.sep, '/'))}"
+    return url + "?download=1" if download else url
@@ -0,0 +1,326 @@
+import getpass
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from utils.filelock import file_lock
+from utils.storage import FLUSH_TIMEOUT, WritesBlockedError, get_write_behind, guarded_write, write_behind_enabled
+
+SNAPSHOT_NAME = "detailed_grades.json"
+# Directory of the per-grader journals, e.g. `.grades/alice@laptop.jsonl`
+SHARDS_DIR_NAME = ".grades"
+LOCK_NAME = ".lock"
+# Single journal written by earlier versions, replayed before the per-grader journals
+LEGACY_JOURNAL_NAME = ".detailed_grades.jsonl"
+# Number of superseded entries after which a journal is rewritten with the latest entry of each student
+COMPACT_THRESHOLD = 200
+
+
+def default_grader() -> str:
+    """Name of the grader used when none is configured, e.g. `alice@laptop`."""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "unknown"
+    return f"{user}@{socket.gethostname()}"
+
+
+def _shard_name(grader: str) -> str:
+    return re.sub(r"[^\w.@-]", "_", grader) + ".jsonl"
+
+
+class GradeStore:
+    """
+    Detailed grades of an assignment, backed by append-only journals sharded per grader.
+
+    Each grader appends to their own file under `.grades/`, so graders sharing a synced folder never write
+    to the same file. Every entry carries its timestamp and grader, and the journals are merged
+    deterministically: for each student, the entry with the largest `(time, grader, line)` wins.
+    `detailed_grades.json` is the base of the merge and is rewritten with the merged grades on export,
+    which keeps it in the format used by the rest of the application.
+
+    In a folder synced by a cloud service, saved scores are applied in memory at once and appended to the
+    journal by the `WriteBehindQueue`. Entries which are not written yet take part in the merge, so they are
+    never hidden by a reload. In a local folder, `save` returns once the entries are appended.
+    """
+
+    def __init__(self, assignment_dir: str):
+        self.snapshot_path = os.path.join(assignment_dir, SNAPSHOT_NAME)
+        self.shards_dir = os.path.join(assignment_dir, SHARDS_DIR_NAME)
+        self.lock_path = os.path.join(self.shards_dir, LOCK_NAME)
+        self.legacy_journal_path = os.path.join(assignment_dir, LEGACY_JOURNAL_NAME)
+        self.write_behind = write_behind_enabled(os.path.abspath(assignment_dir))
+        self._lock = threading.RLock()
+        self._snapshot: tuple[tuple | None, dict[str, dict]] = (None, {})
+        # path -> (stat signature, [((time, grader, line), student, scores), ...], number of lines)
+        self._journals: dict[str, tuple[tuple, list, int]] = {}
+        self._grades: dict[str, dict] = {}
+        self._winners: dict[str, tuple] = {}  # student -> key of the entry in `_grades`
+        self._unwritten: list[tuple] = []  # entries queued for the journals, in the format of `_journals`
+        self._version = 0
+        self._compactor: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._reload_if_changed()
+            return len(self._grades)
+
+    @property
+    def version(self) -> int:
+        """Counter incremented whenever the merged grades change, for caches derived from them."""
+        with self._lock:
+            self._reload_if_changed()
+            return self._version
+
+    def get(self, student: str) -> dict:
+        """Return the saved scores of the student, or an empty dict if not graded yet."""
+        with self._lock:
+            self._reload_if_changed()
+            return dict(self._grades.get(student, {}))
+
+    def to_dict(self) -> dict[str, dict]:
+        """Return the merged detailed grades of all students in the `detailed_grades.json` format."""
+        with self._lock:
+            self._reload_if_changed()
+            return {k: dict(v) for k, v in self._grades.items()}
+
+    def save(self, student: str, scores: dict, grader: str | None = None):
+        """
+        Record the scores of a student by appending them to the journal of the grader.
+
+        Parameters
+        ----------
+        student : str
+            Name of the student directory, e.g. `Name(ID)`.
+        scores : dict
+            Scores of each question.
+        grader : str | None
+            Name of the grader. `default_grader()` is used if None.
+        """
+        self.save_many({student: scores}, grader)
+
+    def save_many(self, grades: dict[str, dict], grader: str | None = None):
+        """
+        Record the scores of several students with a single append to the journal of the grader.
+
+        Raises
+        ------
+        WritesBlockedError
+            If the save directory is being migrated.
+        """
+        grader = grader or default_grader()
+        path = os.path.join(self.shards_dir, _shard_name(grader))
+        now = time.time_ns()
+        lines = [
+            json.dumps({"student": k, "scores": v, "grader": grader, "time": now}, ensure_ascii=False) + "\n"
+            for k, v in grades.items()
+        ]
+        with guarded_write(self.shards_dir):
+            with self._lock:
+                self._reload_if_changed()
+                # provisional line numbers after the queued entries; replaced with the actual ones once written
+                first = self._journals.get(path, (None, [], 0))[2] + len(self._unwritten)
+                entries = [((now, grader, first + i), k, dict(v)) for i, (k, v) in enumerate(grades.items())]
+                for key, student, scores in entries:
+                    # an entry of another grader may be newer if the clocks of the machines differ
+                    if key > self._winners.get(student, (-1, "", -1)):
+                        self._grades[student] = scores
+                        self._winners[student] = key
+                self._unwritten.extend(entries)
+                self._version += 1
+            if self.write_behind:
+                students = ", ".join(grades) if len(grades) <= 3 else f"{len(grades)} 人"
+                label = f"{os.path.basename(os.path.dirname(self.snapshot_path))}: {students} の採点"
+                get_write_behind().submit(
+                    label, self._append, path, lines, entries, grader, on_discard=lambda: self._discard(entries)
+                )
+                return
+            try:
+                self._append(path, lines, entries, grader)
+            except Exception:
+                self._discard(entries)
+                raise
+
+    def _append(self, path: str, lines: list[str], entries: list[tuple], grader: str):
+        """Append saved entries to a journal, on the thread of the `WriteBehindQueue` if enabled."""
+        os.makedirs(self.shards_dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            before = self._stat_signature(path)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            after = self._stat_signature(path)
+        with self._lock:
+            for entry in entries:
+                self._unwritten.remove(entry)
+            signature, journal, n_lines = self._journals.get(path, (None, [], 0))
+            if signature == before:
+                # add the new entries without reading the journal again
+                for i, (key, student, scores) in enumerate(entries):
+                    written = (key[0], key[1], n_lines + i)
+                    journal.append((written, student, scores))
+                    if self._winners.get(student) == key:
+                        self._winners[student] = written
+                self._journals[path] = (after, journal, n_lines + len(lines))
+            # otherwise written by another process in the meantime, and read again on the next access
+            if len(journal) - len({e[1] for e in journal}) >= COMPACT_THRESHOLD:
+                self.compact_async(grader)
+
+    def _discard(self, entries: list[tuple]):
+        """Forget entries which could not be written, restoring the grades from the journals."""
+        with self._lock:
+            for entry in entries:
+                if entry in self._unwritten:
+                    self._unwritten.remove(entry)
+            self._merge()
+
+    def flush(self, timeout: float | None = FLUSH_TIMEOUT) -> bool:
+        """Wait until the queued entries are written to the journals. Return False on timeout."""
+        return not self.write_behind or get_write_behind().flush(timeout)
+
+    def compact(self, grader: str | None = None):
+        """
+        Rewrite the journal of the grader with the latest entry of each student and
+        write the merged grades to `detailed_grades.json`.
+
+        Journals of other graders are left untouched, since they may be written concurrently on other machines.
+        Dropping superseded entries of one grader never changes the result of the merge.
+
+        Raises
+        ------
+        WritesBlockedError
+            If the save directory is being migrated.
+        """
+        grader = grader or default_grader()
+        path = os.path.join(self.shards_dir, _shard_name(grader))
+        # entries still queued after a timeout are kept in `_unwritten`, and written by the queue later
+        self.flush()
+        with guarded_write(self.shards_dir), self._lock, file_lock(self.lock_path):
+            self._reload_if_changed()
+            if path in self._journals:
+                latest = {}
+                for key, student, scores in self._journals[path][1]:
+                    latest[student] = (key, scores)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for student, ((t, g, _), scores) in sorted(latest.items(), key=lambda x: x[1][0]):
+                        f.write(
+                            json.dumps({"student": student, "scores": scores, "grader": g, "time": t}, ensure_ascii=False)
+                            + "\n"
+                        )
+                os.replace(tmp_path, path)
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._grades, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.snapshot_path)
+            # the legacy journal is now part of the snapshot
+            if os.path.exists(self.legacy_journal_path):
+                os.remove(self.legacy_journal_path)
+            self._reload_if_changed()
+
+    def compact_async(self, grader: str | None = None):
+        """Run `compact` on a background thread unless one is already running."""
+        with self._lock:
+            if self._compactor and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact_quietly, args=(grader,), daemon=True)
+            self._compactor.start()
+
+    def _compact_quietly(self, grader: str | None):
+        try:
+            self.compact(grader)
+        except WritesBlockedError:
+            # compacted on a later save
+            pass
+
+    def export(self, grader: str | None = None) -> str:
+        """Bring `detailed_grades.json` up to date with all journals and return its path."""
+        self.compact(grader)
+        return self.snapshot_path
+
+    def _journal_paths(self) -> list[str]:
+        try:
+            with os.scandir(self.shards_dir) as it:
+                paths = [e.path for e in it if e.name.endswith(".jsonl") and e.is_file()]
+        except FileNotFoundError:
+            paths = []
+        if os.path.exists(self.legacy_journal_path):
+            paths.append(self.legacy_journal_path)
+        return sorted(paths)
+
+    @staticmethod
+    def _stat_signature(path: str):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _read_journal(self, path: str) -> tuple[list, int]:
+        entries = []
+        i = -1
+        legacy = path == self.legacy_journal_path
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # ignore a partially written line
+                    continue
+                # entries of the legacy journal come before all entries of the per-grader journals
+                key = (0, "", i) if legacy else (entry.get("time", 0), entry.get("grader", ""), i)
+                entries.append((key, entry["student"], entry["scores"]))
+        return entries, i + 1
+
+    def _reload_if_changed(self):
+        """Re-read the snapshot and the journals modified outside of this store, and merge them again."""
+        changed = False
+        signature = self._stat_signature(self.snapshot_path)
+        if signature != self._snapshot[0]:
+            try:
+                with open(self.snapshot_path, encoding="utf-8") as f:
+                    self._snapshot = (signature, json.load(f))
+            except FileNotFoundError:
+                self._snapshot = (None, {})
+            changed = True
+        paths = self._journal_paths()
+        for path in set(self._journals) - set(paths):
+            del self._journals[path]
+            changed = True
+        for path in paths:
+            signature = self._stat_signature(path)
+            if path in self._journals and self._journals[path][0] == signature:
+                continue
+            try:
+                self._journals[path] = (signature, *self._read_journal(path))
+            except FileNotFoundError:
+                self._journals.pop(path, None)
+            changed = True
+        if changed:
+            self._merge()
+
+    def _merge(self):
+        grades = dict(self._snapshot[1])
+        winners = {}
+        entries = [e for _, journal, _ in self._journals.values() for e in journal] + self._unwritten
+        for key, student, scores in sorted(entries, key=lambda e: e[0]):
+            grades[student] = scores
+            winners[student] = key
+        self._grades = grades
+        self._winners = winners
+        self._version += 1
+
+
+_stores: dict[str, GradeStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_grade_store(assignment_dir: str) -> GradeStore:
+    """Return the process-wide `GradeStore` of the assignment."""
+    key = os.path.abspath(assignment_dir)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = GradeStore(key)
+        return _stores[key]
@@ -0,0 +1,171 @@
+import os
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from utils.assignment_state import AssignmentState, get_assignment_state
+from utils.catalog import ATTACHMENTS_DIR_NAME, Catalog
+from utils.grades_csv import get_grades_csv
+from utils.rubric import RubricError
+
+
+def student_id(student: str) -> str:
+    """Extract the student ID from the name of a student directory (`Name(ID)`)."""
+    return student.split("(")[-1].rstrip(")")
+
+
+@dataclass(frozen=True, eq=False)
+class AssignmentColumns:
+    """Columns of one assignment in the gradebook, indexed by student ID."""
+
+    names: pd.Series  # display names of the students
+    scores: pd.Series  # float, NaN if not graded
+    submitted: pd.Series  # bool
+    graded: pd.Series  # bool
+
+
+def _has_submission(student_dir: str) -> bool:
+    """Whether the student has submitted a text or an attachment."""
+    try:
+        with os.scandir(student_dir) as it:
+            for entry in it:
+                if entry.name.endswith("_submissionText.html"):
+                    return True
+                if entry.name == ATTACHMENTS_DIR_NAME and entry.is_dir() and os.listdir(entry.path):
+                    return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def build_assignment_columns(state: AssignmentState) -> AssignmentColumns:
+    """
+    Collect the grades of an assignment from `grades.csv` and `detailed_grades.json`.
+
+    Students are those listed in `grades.csv` plus those with a directory. The score is taken from
+    `grades.csv` and falls back to the total of the detailed grades if the cell is empty.
+    """
+    try:
+        roster = get_grades_csv(state.assignment_dir).to_frame()
+    except (FileNotFoundError, ValueError):
+        roster = pd.DataFrame(columns=["成績"], index=pd.Index([], name="学生番号"), dtype=str)
+    roster = roster[~roster.index.duplicated()]
+
+    dirs = {student_id(s): s for s in state.students}
+    ids = roster.index.union(pd.Index(list(dirs), dtype=object))
+
+    names = pd.Series({i: s.split("(")[0] for i, s in dirs.items()}, dtype=object).reindex(ids)
+    if {"姓", "名"} <= set(roster.columns):
+        names = (roster["姓"].fillna("") + " " + roster["名"].fillna("")).str.strip().reindex(ids).fillna(names)
+
+    scores = pd.to_numeric(roster["成績"], errors="coerce").reindex(ids)
+    try:
+        rubric = state.rubric
+    except RubricError:
+        rubric = None
+    detailed = state.grades.to_dict()
+    if rubric is not None and detailed:
+        totals = pd.Series({student_id(s): rubric.total(v) for s, v in detailed.items()}, dtype=float)
+        scores = scores.fillna(totals.reindex(ids))
+    graded = scores.notna()
+
+    submitted = pd.Series(
+        [_has_submission(os.path.join(state.assignment_dir, dirs[i])) if i in dirs else False for i in ids],
+        index=ids,
+        dtype=bool,
+    )
+    return AssignmentColumns(names, scores, submitted, graded)
+
+
+class Gradebook:
+    """
+    Grades of all assignments of a subject as one table of students by assignments.
+
+    The columns of each assignment are cached and rebuilt only when its `grades.csv`, detailed grades,
+    rubric or student directories change, so opening the gradebook again only checks file signatures.
+    """
+
+    def __init__(self, catalog: Catalog, subject: str):
+        self.catalog = catalog
+        self.subject = subject
+        self._lock = threading.Lock()
+        self._columns: dict[str, tuple[tuple, AssignmentColumns]] = {}
+        self._table: tuple[tuple, pd.DataFrame] | None = None
+
+    def _assignment_key(self, state: AssignmentState) -> tuple:
+        try:
+            rubric = state.rubric
+        except RubricError:
+            rubric = None
+        try:
+            csv_version = get_grades_csv(state.assignment_dir).version
+        except (FileNotFoundError, ValueError):
+            csv_version = None
+        return (tuple(state.students), state.grades.version, csv_version, rubric)
+
+    def columns(self) -> dict[str, AssignmentColumns]:
+        """Return the columns of each assignment, rebuilding only those of changed assignments."""
+        assignments = self.catalog.assignments(self.subject)
+        columns = {}
+        with self._lock:
+            for assignment in assignments:
+                state = get_assignment_state(self.catalog, self.subject, assignment)
+                key = self._assignment_key(state)
+                cached = self._columns.get(assignment)
+                if not cached or cached[0] != key:
+                    cached = (key, build_assignment_columns(state))
+                    self._columns[assignment] = cached
+                columns[assignment] = cached[1]
+            for assignment in set(self._columns) - set(assignments):
+                del self._columns[assignment]
+        return columns
+
+    def table(self) -> pd.DataFrame:
+        """
+        Return the gradebook indexed by student ID.
+
+        Columns are the name, the score of each assignment, the total, and the numbers of
+        submitted, missing (not submitted) and ungraded (submitted but not graded) assignments.
+        """
+        columns = self.columns()
+        # `AssignmentColumns` compare by identity, so the key changes whenever a column is rebuilt
+        key = tuple(columns.items())
+        with self._lock:
+            if self._table and self._table[0] == key:
+                return self._table[1]
+        if columns:
+            names = pd.concat([c.names for c in columns.values()], axis=1).bfill(axis=1).iloc[:, 0]
+            scores = pd.concat({a: c.scores for a, c in columns.items()}, axis=1)
+            submitted = pd.concat({a: c.submitted for a, c in columns.items()}, axis=1).reindex(scores.index)
+            graded = pd.concat({a: c.graded for a, c in columns.items()}, axis=1).reindex(scores.index)
+            submitted = submitted.fillna(False).to_numpy(dtype=bool)
+            graded = graded.fillna(False).to_numpy(dtype=bool)
+        else:
+            names = pd.Series(dtype=object)
+            scores = pd.DataFrame(index=pd.Index([], dtype=object))
+            submitted = graded = np.zeros((0, 0), dtype=bool)
+        table = scores.copy()
+        table.insert(0, "氏名", names.reindex(scores.index))
+        table["合計"] = scores.sum(axis=1, min_count=1)
+        table["提出"] = submitted.sum(axis=1)
+        table["未提出"] = (~submitted).sum(axis=1)
+        table["未採点"] = (submitted & ~graded).sum(axis=1)
+        table = table.rename_axis("学生番号").sort_index()
+        with self._lock:
+            self._table = (key, table)
+        return table
+
+
+_gradebooks: dict[tuple[str, str], Gradebook] = {}
+_gradebooks_lock = threading.Lock()
+
+
+def get_gradebook(catalog: Catalog, subject: str) -> Gradebook:
+    """Return the process-wide `Gradebook` of the subject."""
+    key = (catalog.base_dir, subject)
+    with _gradebooks_lock:
+        if key not in _gradebooks:
+            _gradebooks[key] = Gradebook(catalog, subject)
+        return _gradebooks[key]
@@ -0,0 +1,193 @@
+import atexit
+import csv
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from utils.filelock import file_lock
+from utils.grade_store import LOCK_NAME, SHARDS_DIR_NAME
+from utils.storage import get_write_behind, guarded_write, write_behind_enabled
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+GRADES_CSV_NAME = "grades.csv"
+# Seconds to wait for further updates before writing grades.csv
+FLUSH_DELAY = 2.0
+
+
+class GradesCsv:
+    """
+    In-memory view of `grades.csv` (official file from PandA) indexed by student ID.
+
+    The file is parsed once and score updates are applied to the parsed rows.
+    Writes are debounced: several updates within `FLUSH_DELAY` seconds result in a single atomic write,
+    run by the `WriteBehindQueue` in a folder synced by a cloud service. Each write re-reads the file under
+    the lock of the assignment, so updates of other graders are kept, and updates made while the file is
+    written are kept for the next write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.write_behind = write_behind_enabled(path)
+        self.lock_path = os.path.join(os.path.dirname(path), SHARDS_DIR_NAME, LOCK_NAME)
+        self._lock = threading.RLock()
+        self._rows: list[list[str]] = []
+        self._index: dict[str, int] = {}
+        self._grade_idx = None
+        self._header_idx = None
+        self._signature = None
+        self._version = 0
+        self._pending: dict[str, str] = {}
+        self._timer: threading.Timer | None = None
+
+    @property
+    def version(self) -> int:
+        """Counter incremented whenever the rows change, for caches derived from them."""
+        with self._lock:
+            self._reload_if_changed()
+            return self._version
+
+    def to_frame(self) -> "pd.DataFrame":
+        """
+        Return the rows below the header as a table of strings indexed by `学生番号`, including pending updates.
+
+        Raises
+        ------
+        ValueError
+            If the header row of `grades.csv` is not found.
+        """
+        import pandas as pd
+
+        with self._lock:
+            self._reload_if_changed()
+            header = self._rows[self._header_idx]
+            rows = [r + [""] * (len(header) - len(r)) for r in self._rows[self._header_idx + 1 :] if r]
+            return pd.DataFrame([r[: len(header)] for r in rows], columns=header, dtype=str).set_index("学生番号")
+
+    def update(self, student_id: str, score: int | float):
+        """
+        Set the grade of a student and schedule a write of the file.
+
+        Parameters
+        ----------
+        student_id : str
+            The student ID (`学生番号`).
+        score : int | float
+            The total score of the student.
+
+        Raises
+        ------
+        ValueError
+            If the header row of `grades.csv` is not found.
+        WritesBlockedError
+            If the save directory is being migrated.
+        """
+        self.update_many({student_id: score})
+
+    def update_many(self, scores: dict[str, int | float]):
+        """Set the grades of several students at once. See `update` for details."""
+        with guarded_write(self.path), self._lock:
+            self._reload_if_changed()
+            for student_id, score in scores.items():
+                if student_id in self._index:
+                    self._pending[student_id] = str(score)
+                    self._apply(student_id, str(score))
+            self._version += 1
+            self._schedule_flush()
+
+    def flush(self):
+        """Write pending updates to the file atomically."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+        with file_lock(self.lock_path):
+            with self._lock:
+                # merge with changes made outside of the app since the file was parsed
+                self._reload_if_changed()
+                rows = [list(r) for r in self._rows]
+                written = dict(self._pending)
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerows(rows)
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._signature = self._stat_signature()
+                for student_id, value in written.items():
+                    if self._pending.get(student_id) == value:
+                        del self._pending[student_id]
+
+    def _apply(self, student_id: str, value: str):
+        row = self._rows[self._index[student_id]]
+        if len(row) <= self._grade_idx:
+            row.extend([""] * (self._grade_idx + 1 - len(row)))
+        row[self._grade_idx] = value
+
+    def _schedule_flush(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(FLUSH_DELAY, self._flush_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_later(self):
+        if self.write_behind:
+            # pending updates stay in memory if discarded, and are written with the next update
+            get_write_behind().submit(self.path, self.flush)
+        else:
+            self.flush()
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self):
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        # find the header row and check the column index for "成績"
+        try:
+            header_idx = next(i for i, r in enumerate(rows) if r and r[0] == "学生番号")
+        except StopIteration:
+            raise ValueError("grades.csv に '学生番号' ヘッダー行が見つかりません。ファイル形式を確認してください。")
+        self._rows = rows
+        self._header_idx = header_idx
+        self._grade_idx = rows[header_idx].index("成績")
+        self._index = {r[0]: i for i, r in enumerate(rows) if i > header_idx and r}
+        self._signature = signature
+        self._version += 1
+        # keep updates which are not written yet
+        for student_id, value in self._pending.items():
+            if student_id in self._index:
+                self._apply(student_id, value)
+
+
+_files: dict[str, GradesCsv] = {}
+_files_lock = threading.Lock()
+
+
+def get_grades_csv(assignment_dir: str) -> GradesCsv:
+    """Return the process-wide `GradesCsv` of the assignment."""
+    path = os.path.abspath(os.path.join(assignment_dir, GRADES_CSV_NAME))
+    with _files_lock:
+        if path not in _files:
+            _files[path] = GradesCsv(path)
+        return _files[path]
+
+
+def flush_all(root: str | None = None):
+    """Write the pending updates of all files, or of the files under `root`."""
+    prefix = os.path.join(os.path.abspath(root), "") if root else ""
+    with _files_lock:
+        files = [f for path, f in _files.items() if path.startswith(prefix)]
+    for f in files:
+        f.flush()
+
+
+atexit.register(flush_all)
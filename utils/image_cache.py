@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CHUNK_SIZE = 1024 * 1024
+
+
+class ImageCache:
+    """
+    Content-addressed cache of images prepared for the viewer.
+
+    Each image is decoded once, rotated according to its EXIF orientation, downscaled to the viewer width
+    and stored as WebP. The least recently used derivatives are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, width: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.width = width
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._size = None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) - 1))
+
+    def get(self, path: str) -> str:
+        """
+        Return the path of the derivative of an image, creating it if necessary.
+
+        Parameters
+        ----------
+        path : str
+            Path of the original image.
+
+        Returns
+        -------
+        str
+            Path of the oriented and downscaled WebP image.
+        """
+        dest = self._derivative_path(path)
+        if os.path.exists(dest):
+            # update mtime for LRU eviction
+            os.utime(dest)
+            return dest
+        # imported on first use, since most reruns only find cached derivatives
+        from PIL import Image, ImageOps
+
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > self.width:
+                image = image.resize((self.width, round(image.height * self.width / image.width)), Image.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            tmp_path = f"{dest}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format="WEBP", quality=85)
+        os.replace(tmp_path, dest)
+        self._add_size(os.path.getsize(dest))
+        return dest
+
+    def prefetch(self, paths: list[str]):
+        """Create derivatives of the images on background threads."""
+        for path in paths:
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                self._pool.submit(self._get_quietly, path)
+
+    def evict(self):
+        """Remove the least recently used derivatives until the cache fits in `max_bytes`."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith(".webp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+
+    def _get_quietly(self, path: str):
+        try:
+            self.get(path)
+        except Exception:
+            # broken images are reported when they are displayed
+            pass
+
+    def _add_size(self, size: int):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _derivative_path(self, path: str) -> str:
+        return os.path.join(self.cache_dir, f"{self._content_hash(path)}_{self.width}.webp")
+
+    def _content_hash(self, path: str) -> str:
+        """Hash the content of the file, memoized by its path, mtime and size."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            digest = self._hashes[key] = h.hexdigest()
+        return digest
+
+
+_caches: dict[tuple[str, int, int], ImageCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_image_cache(cache_dir: str, max_bytes: int, width: int) -> ImageCache:
+    """Return the process-wide `ImageCache` for the given settings."""
+    key = (os.path.abspath(cache_dir), max_bytes, width)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ImageCache(*key)
+        return _caches[key]
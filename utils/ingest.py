@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Callable
+
+# Size of each read/write when streaming data between files
+CHUNK_SIZE = 1024 * 1024
+# Uploads larger than this are spooled to disk instead of being kept in memory
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+# Number of threads used for extracting members of an archive
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+
+def spool_upload(upload: BinaryIO) -> tempfile.SpooledTemporaryFile:
+    """
+    Copy an uploaded file into a spooled temporary file in fixed-size chunks.
+
+    Parameters
+    ----------
+    upload : file-like object
+        The uploaded file (e.g. `UploadedFile` of Streamlit).
+
+    Returns
+    -------
+    tempfile.SpooledTemporaryFile
+        A temporary file positioned at the beginning. Its content is moved to disk
+        once it exceeds `SPOOL_MAX_SIZE`.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    upload.seek(0)
+    shutil.copyfileobj(upload, spool, CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+
+def _is_ignored(name: str) -> bool:
+    """Return True for `__MACOSX` entries and hidden files."""
+    return name.startswith("__MACOSX") or name.startswith(".") or "/__MACOSX" in name or "/." in name
+
+
+def _repair_name(name: str) -> str:
+    """Prevent garbled characters: decode as UTF-8 (cp437→utf-8)."""
+    try:
+        return name.encode("cp437").decode("utf-8")
+    except Exception:
+        return name
+
+
+def plan_extraction(zf: zipfile.ZipFile, outdir: str) -> list[tuple[zipfile.ZipInfo, str]]:
+    """
+    Decide the destination path of each member in the archive.
+
+    Parameters
+    ----------
+    zf : zipfile.ZipFile
+        The opened archive.
+    outdir : str
+        The directory where the contents of the archive will be extracted.
+
+    Returns
+    -------
+    list[tuple[zipfile.ZipInfo, str]]
+        Pairs of a member to extract and its destination path.
+    """
+    members = [
+        (info, _repair_name(info.filename))
+        for info in zf.infolist()
+        if not (_is_ignored(info.filename) or info.is_dir())
+    ]
+    # Detect the common top-level directory in the zip file
+    top_dirs = {filename.split("/", 1)[0] for _, filename in members if "/" in filename}
+    has_top_dir = len(top_dirs) == 1 and all("/" in filename for _, filename in members)
+
+    root = os.path.realpath(outdir)
+    plan = []
+    for info, filename in members:
+        # Remove the common top-level directory
+        parts = filename.split("/")
+        if has_top_dir:
+            parts = parts[1:]
+        if not any(parts):
+            continue
+        dest_path = os.path.join(outdir, *parts)
+        # Never write outside of outdir (e.g. "../" in member names)
+        if not os.path.realpath(dest_path).startswith(root + os.sep):
+            continue
+        plan.append((info, dest_path))
+    return plan
+
+
+def _extract_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, dest_path: str) -> str:
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    # replace existing files by renaming, so that the mtime of the directory shows the change
+    tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+    with zf.open(info) as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def extract_zip(
+    src: BinaryIO,
+    outdir: str,
+    on_progress: Callable[[int, int, str], None] | None = None,
+    max_workers: int = MAX_WORKERS,
+) -> list[str]:
+    """
+    Extract a zip archive into `outdir` using a pool of worker threads.
+
+    Members are streamed from the archive in chunks of `CHUNK_SIZE`, so memory use does not
+    depend on the size of the archive.
+
+    Parameters
+    ----------
+    src : file-like object
+        A seekable file object of the zip archive.
+    outdir : str
+        The directory where the contents of the archive will be extracted.
+    on_progress : Callable[[int, int, str], None] | None
+        Called on the calling thread each time a member is extracted,
+        with the number of extracted members, the total number of members and the destination path.
+    max_workers : int
+        Number of threads used for extraction.
+
+    Returns
+    -------
+    list[str]
+        Paths of the extracted files.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    extracted = []
+    # ZipFile serializes reads of the underlying file, so members can be decompressed concurrently
+    with zipfile.ZipFile(src) as zf:
+        plan = plan_extraction(zf, outdir)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_extract_member, zf, info, dest) for info, dest in plan]
+            for future in as_completed(futures):
+                extracted.append(future.result())
+                if on_progress:
+                    on_progress(len(extracted), len(plan), extracted[-1])
+    return extracted
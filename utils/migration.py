@@ -0,0 +1,373 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from utils.grades_csv import flush_all
+from utils.storage import FLUSH_TIMEOUT, block_writes, get_write_behind, unblock_writes
+
+MANIFEST_NAME = ".migration.json"
+# File in the cache directory recording the running migration, so that it can be resumed after a restart
+POINTER_NAME = "migration.json"
+CHUNK_SIZE = 1024 * 1024
+# Seconds between saves of the manifest
+MANIFEST_INTERVAL = 2.0
+# Number of passes copying files again that were modified during the migration
+MAX_PASSES = 3
+
+
+class MigrationError(Exception):
+    """Raised when the save directory cannot be migrated."""
+
+
+@dataclass(frozen=True)
+class MigrationProgress:
+    phase: str  # "scan", "copy", "verify", "switch", "cleanup", "done" or "failed"
+    total_files: int = 0
+    done_files: int = 0
+    total_bytes: int = 0
+    done_bytes: int = 0
+    error: str | None = None
+
+    @property
+    def fraction(self) -> float:
+        if self.total_bytes:
+            return self.done_bytes / self.total_bytes
+        return self.done_files / self.total_files if self.total_files else 0.0
+
+
+def _appended_in_place(rel: str) -> bool:
+    """Whether the app modifies the file in place, so that a hard link would also change the source."""
+    return rel.endswith(".jsonl")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Migration:
+    """
+    Copies or moves the save directory to a new location.
+
+    Files are transferred on a thread pool. If both directories are on the same file system, a move renames
+    the entries and a copy creates hard links (except for the grade journals, which are appended in place).
+    Otherwise files are copied and the SHA-256 of each copy is compared with that of the source.
+    Finished files are recorded with their mtime, size and SHA-256 in a manifest in the destination, so an
+    interrupted migration resumes with the remaining files. Saves into the source are blocked by
+    `start_migration` while the migration runs. Before `on_complete` switches the save directory, every
+    source file is checked against the manifest, files modified in the meantime are transferred again and
+    the copies are hashed once more. A move only deletes the source files which are unchanged since they
+    were transferred.
+    """
+
+    def __init__(self, source: str, dest: str, move: bool = False, max_workers: int = 8):
+        self.source = os.path.abspath(source)
+        self.dest = os.path.abspath(dest)
+        self.move = move
+        self.max_workers = max_workers
+        self.manifest_path = os.path.join(self.dest, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._progress = MigrationProgress("scan")
+        self._done: dict[str, list] = {}  # relative path -> [mtime_ns, size, sha256 or "link"]
+        self._saved_at = 0.0
+
+    @property
+    def progress(self) -> MigrationProgress:
+        with self._lock:
+            return self._progress
+
+    def run(self, on_complete=None):
+        """
+        Migrate the files, call `on_complete(dest)` and remove the manifest (and the source if moving).
+
+        Raises
+        ------
+        MigrationError
+            If a directory is inside the other, or a copy does not match its source.
+        """
+        for a, b in ((self.source, self.dest), (self.dest, self.source)):
+            if os.path.commonpath([a, b]) == a:
+                raise MigrationError(f"移行元と移行先のフォルダが重なっています: {self.source} → {self.dest}")
+        os.makedirs(self.dest, exist_ok=True)
+        self._flush_writes()
+        same_fs = os.stat(self.source).st_dev == os.stat(self.dest).st_dev
+        renamed = self.move and same_fs
+        if renamed:
+            self._rename_all()
+        else:
+            self._load_manifest()
+            for attempt in range(MAX_PASSES + 1):
+                self._set_phase("scan")
+                files, dirs = self._scan()
+                todo = [rel for rel, sig in files.items() if not self._is_done(rel, sig)]
+                if not todo:
+                    break
+                if attempt == MAX_PASSES:
+                    raise MigrationError("移行中に変更され続けているファイルがあります。採点を中断してから再試行してください。")
+                self._transfer_all(files, dirs, todo, link=same_fs and not self.move)
+            self._verify(files)
+        self._set_phase("switch")
+        if on_complete:
+            on_complete(self.dest)
+        self._set_phase("cleanup")
+        if self.move and not renamed:
+            self._remove_transferred(files)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        self._set_phase("done")
+
+    def _flush_writes(self):
+        """Write the saves accepted before the source was blocked, so that they are transferred."""
+        flush_all(self.source)
+        write_behind = get_write_behind()
+        if not write_behind.flush(FLUSH_TIMEOUT):
+            raise MigrationError("保存先への書き込みが終わっていません。しばらく待ってから再試行してください。")
+        # a retry after the migration would write them into the old save directory
+        if write_behind.failed:
+            raise MigrationError("保存先に書き込めなかった変更があります。採点ページから再試行するか破棄してください。")
+
+    def _scan(self) -> tuple[dict[str, tuple[int, int]], list[str]]:
+        files, dirs = {}, []
+        for root, dirnames, filenames in os.walk(self.source):
+            rel_root = os.path.relpath(root, self.source)
+            dirs.extend(os.path.normpath(os.path.join(rel_root, d)) for d in dirnames)
+            for name in filenames:
+                if rel_root == "." and name == MANIFEST_NAME:
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files[os.path.normpath(os.path.join(rel_root, name))] = (stat.st_mtime_ns, stat.st_size)
+        return files, dirs
+
+    def _is_done(self, rel: str, signature: tuple[int, int]) -> bool:
+        entry = self._done.get(rel)
+        return bool(entry) and tuple(entry[:2]) == signature and os.path.exists(os.path.join(self.dest, rel))
+
+    def _transfer_all(self, files: dict, dirs: list[str], todo: list[str], link: bool):
+        for rel in dirs:
+            os.makedirs(os.path.join(self.dest, rel), exist_ok=True)
+        with self._lock:
+            done = [rel for rel in files if rel not in todo]
+            self._progress = MigrationProgress(
+                "copy",
+                total_files=len(files),
+                done_files=len(done),
+                total_bytes=sum(size for _, size in files.values()),
+                done_bytes=sum(files[rel][1] for rel in done),
+            )
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                # raise the first error after the running transfers have finished
+                for _ in pool.map(lambda rel: self._transfer(rel, link and not _appended_in_place(rel)), todo):
+                    pass
+        finally:
+            # keep the finished files for the next attempt
+            self._save_manifest(force=True)
+
+    def _transfer(self, rel: str, link: bool):
+        src = os.path.join(self.source, rel)
+        dst = os.path.join(self.dest, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp_path = f"{dst}.{threading.get_ident()}.tmp"
+        stat = os.stat(src)
+        if link:
+            # renaming a link onto another link of the same file does nothing, and would leave the temporary file
+            if not (os.path.exists(dst) and os.path.samefile(src, dst)):
+                os.link(src, tmp_path)
+                os.replace(tmp_path, dst)
+            digest = "link"
+        else:
+            h = hashlib.sha256()
+            with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    fdst.write(chunk)
+                fdst.flush()
+                os.fsync(fdst.fileno())
+            shutil.copystat(src, tmp_path)
+            digest = h.hexdigest()
+            # read the copy back, since a faulty disk or sync client may store something else
+            if _sha256(tmp_path) != digest:
+                os.remove(tmp_path)
+                raise MigrationError(f"コピーしたファイルのチェックサムが一致しません: {rel}")
+            os.replace(tmp_path, dst)
+        with self._lock:
+            self._done[rel] = [stat.st_mtime_ns, stat.st_size, digest]
+            p = self._progress
+            self._progress = MigrationProgress(
+                p.phase, p.total_files, p.done_files + 1, p.total_bytes, p.done_bytes + stat.st_size
+            )
+        self._save_manifest()
+
+    def _verify(self, files: dict):
+        """
+        Check that every source file has a copy, unchanged since it was transferred.
+
+        Copies are hashed again, including those transferred before the migration was resumed.
+        """
+        with self._lock:
+            self._progress = MigrationProgress(
+                "verify", total_files=len(files), total_bytes=sum(size for _, size in files.values())
+            )
+        for rel, signature in files.items():
+            entry = self._done.get(rel)
+            dst = os.path.join(self.dest, rel)
+            if not entry or tuple(entry[:2]) != signature or not os.path.exists(dst):
+                raise MigrationError(f"コピーされていないファイルがあります: {rel}")
+            if entry[2] == "link":
+                if not os.path.samefile(os.path.join(self.source, rel), dst):
+                    raise MigrationError(f"コピーしたファイルが移行元と異なります: {rel}")
+            elif _sha256(dst) != entry[2]:
+                raise MigrationError(f"コピーしたファイルのチェックサムが一致しません: {rel}")
+            with self._lock:
+                p = self._progress
+                self._progress = MigrationProgress(
+                    p.phase, p.total_files, p.done_files + 1, p.total_bytes, p.done_bytes + signature[1]
+                )
+
+    def _remove_transferred(self, files: dict):
+        """Delete the source files unchanged since they were transferred, and the directories left empty."""
+        for rel in files:
+            src = os.path.join(self.source, rel)
+            try:
+                stat = os.stat(src)
+            except FileNotFoundError:
+                continue
+            if tuple(self._done[rel][:2]) == (stat.st_mtime_ns, stat.st_size):
+                os.remove(src)
+        for root, _, _ in os.walk(self.source, topdown=False):
+            if root != self.source:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    # kept files, modified by another process after they were transferred
+                    pass
+
+    def _rename_all(self):
+        """
+        Move the entries of the source by renaming them, merging into existing directories of the destination.
+
+        Entries created in the source in the meantime (e.g. by another process) are moved by another pass.
+        """
+        for _ in range(MAX_PASSES):
+            entries = sorted(os.listdir(self.source))
+            if not entries:
+                return
+            self._rename_entries(entries)
+        if os.listdir(self.source):
+            raise MigrationError("移行中に変更され続けているファイルがあります。採点を中断してから再試行してください。")
+
+    def _rename_entries(self, entries: list[str]):
+        with self._lock:
+            self._progress = MigrationProgress("copy", total_files=len(entries))
+        for name in entries:
+            src = os.path.join(self.source, name)
+            dst = os.path.join(self.dest, name)
+            if not os.path.exists(dst):
+                os.rename(src, dst)
+            elif os.path.isdir(src) and os.path.isdir(dst):
+                # e.g. resumed after some files of the directory were moved
+                for root, _, filenames in os.walk(src):
+                    target = os.path.join(dst, os.path.relpath(root, src))
+                    os.makedirs(target, exist_ok=True)
+                    for filename in filenames:
+                        os.replace(os.path.join(root, filename), os.path.join(target, filename))
+                shutil.rmtree(src)
+            else:
+                os.replace(src, dst)
+            with self._lock:
+                p = self._progress
+                self._progress = MigrationProgress(p.phase, p.total_files, p.done_files + 1)
+
+    def _set_phase(self, phase: str):
+        with self._lock:
+            p = self._progress
+            self._progress = MigrationProgress(phase, p.total_files, p.done_files, p.total_bytes, p.done_bytes)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get("source") == self.source:
+            self._done = data["files"]
+
+    def _save_manifest(self, force: bool = False):
+        with self._lock:
+            if not force and time.monotonic() - self._saved_at < MANIFEST_INTERVAL:
+                return
+            self._saved_at = time.monotonic()
+            data = {"source": self.source, "files": dict(self._done)}
+        tmp_path = f"{self.manifest_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+
+_active: Migration | None = None
+_active_lock = threading.Lock()
+
+
+def start_migration(source: str, dest: str, move: bool, cache_dir: str, on_complete) -> Migration:
+    """
+    Run a `Migration` on a background thread, so that it continues if the browser tab is closed.
+
+    The migration is recorded in the cache directory until it is done, see `interrupted_migration`.
+    Saves into the source are refused (see `block_writes`) until the migration is done or failed.
+
+    Raises
+    ------
+    MigrationError
+        If another migration is running.
+    """
+    global _active
+    with _active_lock:
+        if _active and _active.progress.phase not in ("done", "failed"):
+            raise MigrationError("別のデータ移行が実行中です。")
+        migration = _active = Migration(source, dest, move)
+    block_writes(migration.source)
+    pointer_path = os.path.join(cache_dir, POINTER_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(pointer_path, "w", encoding="utf-8") as f:
+        json.dump({"source": migration.source, "dest": migration.dest, "move": move}, f, ensure_ascii=False)
+
+    def run():
+        try:
+            migration.run(on_complete)
+            os.remove(pointer_path)
+        except Exception as e:
+            with migration._lock:
+                p = migration._progress
+                migration._progress = MigrationProgress(
+                    "failed", p.total_files, p.done_files, p.total_bytes, p.done_bytes, str(e)
+                )
+        finally:
+            unblock_writes(migration.source)
+
+    threading.Thread(target=run, daemon=True).start()
+    return migration
+
+
+def get_active_migration() -> Migration | None:
+    """Return the migration started in this process, if any."""
+    with _active_lock:
+        return _active
+
+
+def interrupted_migration(cache_dir: str) -> dict | None:
+    """Return the source, destination and mode of a migration which did not finish, or None."""
+    if get_active_migration():
+        return None
+    try:
+        with open(os.path.join(cache_dir, POINTER_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
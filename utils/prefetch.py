@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from utils.catalog import ATTACHMENTS_DIR_NAME
+from utils.image_cache import IMAGE_EXTENSIONS, ImageCache
+from utils.storage import LocalMirror
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class Submission:
+    """Contents of a student directory needed to render the Grading page."""
+
+    student_dir: str
+    html_content: str | None = None
+    attachments: list[str] = field(default_factory=list)
+    comment_text: str = ""
+
+    @property
+    def attachments_dir(self) -> str:
+        return os.path.join(self.student_dir, ATTACHMENTS_DIR_NAME)
+
+
+def _signature(student_dir: str):
+    """
+    Modification times of the files which affect the `Submission` of the student.
+
+    Besides the directories, whose mtimes change when files are added, removed or replaced by renaming,
+    the submitted text and the comments are included, since they may be edited in place.
+    """
+    signature = []
+    for path in (student_dir, os.path.join(student_dir, ATTACHMENTS_DIR_NAME)):
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            signature.append(None)
+    try:
+        with os.scandir(student_dir) as it:
+            files = [e for e in it if e.name.endswith("_submissionText.html") or e.name == "comments.txt"]
+        for entry in sorted(files, key=lambda e: e.name):
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    except FileNotFoundError:
+        pass
+    return tuple(signature)
+
+
+def load_submission(student_dir: str) -> Submission:
+    """Read the submitted text, the list of attachments and the comments of a student."""
+    htmls = list(Path(student_dir).glob("*_submissionText.html"))
+    html_content = htmls and Path(htmls[0]).read_text(encoding="utf-8").strip() or None
+
+    attachments_dir = os.path.join(student_dir, ATTACHMENTS_DIR_NAME)
+    attachments = sorted(os.listdir(attachments_dir)) if os.path.isdir(attachments_dir) else []
+
+    comments_path = os.path.join(student_dir, "comments.txt")
+    if os.path.isfile(comments_path):
+        comment_text = Path(comments_path).read_text(encoding="utf-8")
+    else:
+        comment_text = ""
+    return Submission(student_dir, html_content, attachments, comment_text)
+
+
+class SubmissionPrefetcher:
+    """
+    Loads submissions of the upcoming students on background threads.
+
+    Once the student directory is parsed, the attachments are warmed by a separate task: they are copied
+    into the `LocalMirror` (or read once so that they are in the OS page cache if the mirror is disabled),
+    and image derivatives are created in the `ImageCache` from the local copies. `get` only waits for the
+    parsing, so jumping to a student whose attachments are still being warmed is not slowed down.
+    """
+
+    def __init__(self, image_cache: ImageCache, mirror: LocalMirror, max_entries: int = 16, max_workers: int = 4):
+        self.image_cache = image_cache
+        self.mirror = mirror
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._warm_pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple, Submission]] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+
+    def get(self, student_dir: str) -> Submission:
+        """Return the submission of the student, waiting for a running prefetch if any."""
+        with self._lock:
+            future = self._pending.get(student_dir)
+        if future:
+            future.result()
+        with self._lock:
+            entry = self._entries.get(student_dir)
+            if entry and entry[0] == _signature(student_dir):
+                self._entries.move_to_end(student_dir)
+                return entry[1]
+        return self._load(student_dir, warm=False)
+
+    def prefetch(self, student_dirs: list[str]):
+        """Start loading the submissions of the students in the background."""
+        with self._lock:
+            for student_dir in student_dirs:
+                if student_dir in self._pending:
+                    continue
+                entry = self._entries.get(student_dir)
+                if entry and entry[0] == _signature(student_dir):
+                    continue
+                future = self._pool.submit(self._load, student_dir, True)
+                future.add_done_callback(lambda _, d=student_dir: self._done(d))
+                self._pending[student_dir] = future
+
+    def set_comment(self, student_dir: str, comment_text: str):
+        """Update the comment of a loaded submission, while the new `comments.txt` is queued for writing."""
+        with self._lock:
+            entry = self._entries.get(student_dir)
+            if entry:
+                entry[1].comment_text = comment_text
+
+    def invalidate(self, student_dir: str):
+        """Forget the loaded submission, e.g. after a queued write of its comment was discarded."""
+        with self._lock:
+            self._entries.pop(student_dir, None)
+
+    def _done(self, student_dir: str):
+        with self._lock:
+            self._pending.pop(student_dir, None)
+
+    def _load(self, student_dir: str, warm: bool) -> Submission:
+        signature = _signature(student_dir)
+        submission = load_submission(student_dir)
+        if warm:
+            self._warm_pool.submit(self._warm, submission)
+        with self._lock:
+            self._entries[student_dir] = (signature, submission)
+            self._entries.move_to_end(student_dir)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return submission
+
+    def _warm(self, submission: Submission):
+        for name in submission.attachments:
+            path = os.path.join(submission.attachments_dir, name)
+            try:
+                if self.mirror.enabled:
+                    path = self.mirror.get(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    self.image_cache.get(path)
+                elif not self.mirror.enabled:
+                    with open(path, "rb") as f:
+                        while f.read(CHUNK_SIZE):
+                            pass
+            except Exception:
+                # errors are reported when the submission is displayed
+                pass
+
+
+_prefetchers: dict[tuple[int, int], SubmissionPrefetcher] = {}
+_prefetchers_lock = threading.Lock()
+
+
+def get_prefetcher(image_cache: ImageCache, mirror: LocalMirror) -> SubmissionPrefetcher:
+    """Return the process-wide `SubmissionPrefetcher` using the given caches."""
+    key = (id(image_cache), id(mirror))
+    with _prefetchers_lock:
+        if key not in _prefetchers:
+            _prefetchers[key] = SubmissionPrefetcher(image_cache, mirror)
+        return _prefetchers[key]
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HEIC_EXTENSIONS = (".heic", ".heif")
+OFFICE_EXTENSIONS = (".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", ".odt", ".odp", ".ods", ".rtf")
+PREVIEW_EXTENSIONS = HEIC_EXTENSIONS + OFFICE_EXTENSIONS
+CHUNK_SIZE = 1024 * 1024
+# Seconds to wait for LibreOffice to convert a single document
+CONVERT_TIMEOUT = 180
+SOFFICE_CANDIDATES = ("soffice", "libreoffice", "/Applications/LibreOffice.app/Contents/MacOS/soffice")
+
+
+def find_soffice() -> str | None:
+    """Return the path of the LibreOffice executable, or None if it is not installed."""
+    for candidate in SOFFICE_CANDIDATES:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+
+def heic_supported() -> bool:
+    """Whether `pillow-heif` is installed."""
+    try:
+        import pillow_heif  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class PreviewCache:
+    """
+    Content-addressed cache of viewable previews of attachments the browser cannot show.
+
+    HEIC images are converted to JPEG with `pillow-heif`, and office documents to PDF with LibreOffice in
+    headless mode. Both tools are optional: attachments are left as links if the tool is not installed.
+    Conversions run on a worker pool started at ingest, so the Grading page only looks up finished previews.
+    """
+
+    def __init__(self, cache_dir: str, max_workers: int | None = None):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.soffice = find_soffice()
+        self.heic = heic_supported()
+        self._lock = threading.Lock()
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._pending: set[str] = set()
+        self._failed: set[str] = set()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1))
+
+    def supports(self, path: str) -> bool:
+        """Whether a preview of the file can be created with the tools installed."""
+        ext = os.path.splitext(path)[1].lower()
+        return (ext in HEIC_EXTENSIONS and self.heic) or (ext in OFFICE_EXTENSIONS and self.soffice is not None)
+
+    def lookup(self, path: str) -> str | None:
+        """Return the path of the finished preview of the file, or None if there is none yet."""
+        if not self.supports(path):
+            return None
+        dest = self._preview_path(path)
+        return dest if os.path.exists(dest) else None
+
+    def is_pending(self, path: str) -> bool:
+        """Whether the conversion of the file is queued or running."""
+        with self._lock:
+            return os.path.abspath(path) in self._pending
+
+    def submit(self, paths: list[str]):
+        """Queue the conversion of the files which have a supported format and no preview yet."""
+        for path in paths:
+            if not self.supports(path):
+                continue
+            key = os.path.abspath(path)
+            with self._lock:
+                if key in self._pending or key in self._failed:
+                    continue
+                self._pending.add(key)
+            self._pool.submit(self._convert_quietly, key)
+
+    def convert(self, path: str) -> str:
+        """
+        Create the preview of the file if necessary and return its path.
+
+        Raises
+        ------
+        RuntimeError
+            If the file is not supported or the conversion failed.
+        """
+        if not self.supports(path):
+            raise RuntimeError(f"プレビューを作成できない形式です: {path}")
+        dest = self._preview_path(path)
+        if os.path.exists(dest):
+            return dest
+        tmp_path = f"{dest}.{threading.get_ident()}.tmp"
+        if os.path.splitext(path)[1].lower() in HEIC_EXTENSIONS:
+            self._convert_heic(path, tmp_path)
+        else:
+            self._convert_office(path, tmp_path)
+        os.replace(tmp_path, dest)
+        return dest
+
+    def _convert_quietly(self, path: str):
+        try:
+            self.convert(path)
+        except Exception:
+            # the attachment stays available as a link
+            with self._lock:
+                self._failed.add(path)
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _convert_heic(self, path: str, dest: str):
+        import pillow_heif
+        from PIL import Image, ImageOps
+
+        pillow_heif.register_heif_opener()
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.save(dest, format="JPEG", quality=90)
+
+    def _convert_office(self, path: str, dest: str):
+        # LibreOffice allows one process per user profile, so each worker thread uses its own profile
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            profile = self._local.profile = tempfile.mkdtemp(prefix="ta-assistant-lo-")
+        with tempfile.TemporaryDirectory() as outdir:
+            subprocess.run(
+                [
+                    self.soffice,
+                    f"-env:UserInstallation={Path(profile).as_uri()}",
+                    "--headless",
+                    "--convert-to",
+                    "pdf",
+                    "--outdir",
+                    outdir,
+                    path,
+                ],
+                check=True,
+                capture_output=True,
+                timeout=CONVERT_TIMEOUT,
+            )
+            out = os.path.join(outdir, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+            if not os.path.exists(out):
+                raise RuntimeError(f"LibreOffice による変換に失敗しました: {path}")
+            shutil.move(out, dest)
+
+    def _preview_path(self, path: str) -> str:
+        suffix = ".jpg" if os.path.splitext(path)[1].lower() in HEIC_EXTENSIONS else ".pdf"
+        return os.path.join(self.cache_dir, self._content_hash(path) + suffix)
+
+    def _content_hash(self, path: str) -> str:
+        """Hash the content of the file, memoized by its path, mtime and size."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+            digest = self._hashes[key] = h.hexdigest()
+        return digest
+
+
+_caches: dict[str, PreviewCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_preview_cache(cache_dir: str) -> PreviewCache:
+    """Return the process-wide `PreviewCache` of the directory."""
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PreviewCache(key)
+        return _caches[key]
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+
+@dataclass
+class Span:
+    name: str
+    start_ms: float  # since the start of the rerun
+    duration_ms: float
+    depth: int  # nesting level
+
+
+class Tracer:
+    """
+    Collects timing spans of a single script rerun.
+
+    Usage
+    -----
+        with tracer.span("load_grades"):
+            ...
+    """
+
+    def __init__(self, page: str, trace_file: str | None = None):
+        self.page = page
+        self.trace_file = trace_file
+        self.spans: list[Span] = []
+        self._start = time.perf_counter()
+        self._depth = 0
+        self.total_ms = None
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            end = time.perf_counter()
+            self.spans.append(Span(name, (start - self._start) * 1000, (end - start) * 1000, self._depth))
+
+    def finish(self) -> list[Span]:
+        """End the rerun, append it to the trace file if configured, and return the spans in start order."""
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+        self.spans.sort(key=lambda s: s.start_ms)
+        if self.trace_file:
+            record = {
+                "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+                "page": self.page,
+                "total_ms": round(self.total_ms, 3),
+                "spans": [asdict(s) for s in self.spans],
+            }
+            _append_line(self.trace_file, json.dumps(record, ensure_ascii=False))
+        return self.spans
+
+
+_trace_lock = threading.Lock()
+
+
+def _append_line(path: str, line: str):
+    with _trace_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+
+ALLOCATION_TYPES = ("partial", "full-or-zero")
+
+
+class RubricError(ValueError):
+    """Raised when `allocation.json` is not a valid rubric."""
+
+
+@dataclass(frozen=True)
+class Rubric:
+    """
+    Flat representation of `allocation.json`.
+
+    The i-th element of each tuple describes the i-th gradable item (leaf) in the order of the allocation.
+    """
+
+    ids: tuple[str, ...]  # keys in detailed_grades.json, e.g. "問5_(a)"
+    labels: tuple[str, ...]  # labels of the widgets, e.g. "(a)"
+    max_scores: tuple[int, ...]
+    types: tuple[str, ...]
+    answers: tuple[str, ...]
+    headings: tuple[tuple[str, ...], ...]  # headings of the groups starting right before each item
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def max_total(self) -> int:
+        return sum(self.max_scores)
+
+    def total(self, scores: dict[str, int]) -> int:
+        """Return the total of the scores of the items in this rubric."""
+        return sum(scores.get(i, 0) for i in self.ids)
+
+
+def _to_score(prefix: str, value) -> int:
+    if isinstance(value, bool):
+        raise RubricError(f"{prefix}: 配点が整数ではありません ({value!r})")
+    try:
+        score = int(value)
+    except (TypeError, ValueError):
+        raise RubricError(f"{prefix}: 配点が整数ではありません ({value!r})")
+    if score != value and str(score) != str(value).strip():
+        raise RubricError(f"{prefix}: 配点が整数ではありません ({value!r})")
+    if score < 0:
+        raise RubricError(f"{prefix}: 配点が負の値です ({value!r})")
+    return score
+
+
+def compile_rubric(allocation: dict) -> Rubric:
+    """
+    Compile `allocation.json` into a `Rubric`, validating it on the way.
+
+    Raises
+    ------
+    RubricError
+        If an item has an unknown `type`, a non-integer `score`, or a node is not a dict.
+    """
+    ids, labels, max_scores, types, answers, headings = [], [], [], [], [], []
+    pending_headings = []
+
+    def recurse(prefix: str, label: str, alloc):
+        if not isinstance(alloc, dict):
+            raise RubricError(f"不正なデータ形式: {prefix} -> {alloc}")
+        if "score" in alloc and "type" in alloc:
+            if alloc["type"] not in ALLOCATION_TYPES:
+                raise RubricError(f"{prefix}: 不明な配点の種類です ({alloc['type']!r})")
+            ids.append(prefix)
+            labels.append(label)
+            max_scores.append(_to_score(prefix, alloc["score"]))
+            types.append(alloc["type"])
+            answers.append(str(alloc.get("answer", "") or ""))
+            headings.append(tuple(pending_headings))
+            pending_headings.clear()
+            return
+        pending_headings.append(prefix)
+        for k, v in alloc.items():
+            recurse(f"{prefix}_{k}", k, v)
+
+    if not isinstance(allocation, dict):
+        raise RubricError(f"不正なデータ形式: {allocation}")
+    for k, v in allocation.items():
+        recurse(k, k, v)
+    return Rubric(tuple(ids), tuple(labels), tuple(max_scores), tuple(types), tuple(answers), tuple(headings))
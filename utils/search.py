@@ -0,0 +1,402 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from html.parser import HTMLParser
+
+from utils.catalog import ATTACHMENTS_DIR_NAME, get_catalog
+
+INDEX_FORMAT = 2
+# Seconds during which an index is not checked again for changed submissions
+REFRESH_INTERVAL = 10.0
+SNIPPET_WIDTH = 30
+# Seconds to wait for `pdftotext` to extract a single PDF
+EXTRACT_TIMEOUT = 60
+# ASCII words, or runs of other word characters (Japanese has no spaces between words)
+_SEGMENT = re.compile(r"[0-9a-z_]+|[^\W0-9a-z_]+")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("br", "p", "div", "li", "tr"):
+            self.parts.append("\n")
+
+
+def html_to_text(html: str) -> str:
+    """Return the text content of an HTML document."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+
+def pdf_supported() -> bool:
+    """Whether the text of PDFs can be extracted, with `pypdf` or the `pdftotext` command of Poppler."""
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return shutil.which("pdftotext") is not None
+    return True
+
+
+def pdf_to_text(path: str) -> str:
+    """Return the text layer of a PDF. See `pdf_supported` for the extractors used."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        result = subprocess.run(
+            [shutil.which("pdftotext"), "-q", "-enc", "UTF-8", path, "-"],
+            capture_output=True,
+            timeout=EXTRACT_TIMEOUT,
+        )
+        return result.stdout.decode("utf-8", errors="replace")
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+def normalize(text: str) -> str:
+    """Normalize full-width characters and case, so that `Ｈａｍｉｌｔｏｎ` matches `hamilton`."""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str) -> set[str]:
+    """
+    Split normalized text into index terms.
+
+    ASCII words are indexed as whole words, and other runs of characters as character bigrams.
+    """
+    tokens = set()
+    for run in _SEGMENT.findall(text):
+        if run.isascii() or len(run) == 1:
+            tokens.add(run)
+        else:
+            tokens.update(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    assignment_dir: str
+    student: str  # name of the student directory (`Name(ID)`)
+    file: str  # path relative to the student directory
+    snippet: str
+
+
+class AssignmentIndex:
+    """
+    Inverted index over the submitted texts and PDF attachments of an assignment.
+
+    The extracted texts are stored in the cache directory together with the mtime and size of each file.
+    A refresh lists the files only of students whose directory signature in the `Catalog` changed, and
+    extracts only new or modified files. Candidate documents are found by intersecting
+    posting sets and confirmed by a substring match on the normalized text. ASCII words in a query match
+    words starting with them, e.g. `hamil` finds `Hamilton`, using a sorted list of the ASCII terms.
+    A single non-ASCII character matches the bigrams containing it.
+    An index which was not refreshed yet in this process is refreshed in the background, and searches use
+    the texts loaded from the cache meanwhile (see `indexing`).
+    """
+
+    def __init__(self, assignment_dir: str, index_path: str):
+        self.assignment_dir = assignment_dir
+        self.index_path = index_path
+        self._lock = threading.RLock()
+        # held during a whole refresh, while `_lock` is only held to read and update the index
+        self._refresh_lock = threading.Lock()
+        self._docs: dict[str, tuple[list, str]] = {}  # relative path -> (signature, normalized text)
+        self._postings: dict[str, set[str]] = {}
+        self._ascii_terms: list[str] | None = []  # sorted ASCII terms of `_postings`, None if to be sorted again
+        self._char_terms: dict[str, set[str]] = {}  # non-ASCII character -> bigrams of `_postings` containing it
+        self._students: dict[str, tuple] = {}  # student -> signature of the directories
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._pdf = pdf_supported()
+
+    def search(self, query: str, limit: int | None = None) -> list[SearchHit]:
+        """Return the documents containing the query, refreshing the index first if it may be stale."""
+        query = normalize(query).strip()
+        if not query:
+            return []
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            first = not self._refreshed_at
+        if first:
+            # extracting all files of an assignment may take minutes; the loaded texts are searched meanwhile
+            refresh_async(self)
+        else:
+            # a running refresh (e.g. right after ingest) is not waited for; the index is searched as it is
+            self.refresh(max_age=REFRESH_INTERVAL, wait=False)
+        with self._lock:
+            candidates = self._candidates(query)
+            hits = []
+            for path in sorted(candidates):
+                text = self._docs[path][1]
+                pos = text.find(query)
+                if pos < 0:
+                    continue
+                student, file = path.split("/", 1)
+                start = max(0, pos - SNIPPET_WIDTH)
+                snippet = " ".join(text[start : pos + len(query) + SNIPPET_WIDTH].split())
+                hits.append(SearchHit(self.assignment_dir, student, file, ("…" if start else "") + snippet))
+                if limit and len(hits) >= limit:
+                    break
+            return hits
+
+    @property
+    def indexing(self) -> bool:
+        """Whether the index was not refreshed yet in this process, so that searches may miss files."""
+        with self._lock:
+            return not self._refreshed_at
+
+    def texts(self) -> dict[str, str]:
+        """Return the normalized text of each student, joining all indexed files of the student."""
+        self.refresh(max_age=REFRESH_INTERVAL)
+        with self._lock:
+            texts: dict[str, list[str]] = {}
+            for path in sorted(self._docs):
+                texts.setdefault(path.split("/", 1)[0], []).append(self._docs[path][1])
+            return {student: "\n".join(parts) for student, parts in texts.items()}
+
+    def refresh(self, max_age: float = 0.0, wait: bool = True):
+        """
+        Index new or modified files and drop removed ones.
+
+        Texts are extracted without holding the lock of the index, so searches are not blocked meanwhile.
+        If another refresh is running, it is waited for only if `wait`.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if time.monotonic() - self._refreshed_at < max_age:
+                return
+        if not self._refresh_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                if time.monotonic() - self._refreshed_at < max_age:
+                    # refreshed by another thread while waiting
+                    return
+                known = dict(self._students)
+                signatures = {p: doc[0] for p, doc in self._docs.items()}
+
+            catalog = get_catalog(os.path.dirname(os.path.dirname(self.assignment_dir)))
+            subject = os.path.basename(os.path.dirname(self.assignment_dir))
+            assignment = os.path.basename(self.assignment_dir)
+            students = {
+                s: catalog.student_signature(subject, assignment, s) for s in catalog.students(subject, assignment)
+            }
+            changed = [s for s, sig in students.items() if known.get(s) != sig]
+            removed = [s for s in known if s not in students]
+
+            # collect documents of changed students whose files were modified
+            stale, to_extract = set(), []
+            for student in removed:
+                stale.update(p for p in signatures if p.startswith(student + "/"))
+            for student in changed:
+                current = _list_documents(self.assignment_dir, student, self._pdf)
+                stale.update(p for p in signatures if p.startswith(student + "/") and p not in current)
+                to_extract.extend(p for p, sig in current.items() if signatures.get(p) != sig)
+
+            if to_extract:
+                with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+                    extracted = list(pool.map(self._extract, to_extract))
+            else:
+                extracted = []
+
+            with self._lock:
+                for path in stale:
+                    self._remove(path)
+                retry = set()
+                for path, doc in zip(to_extract, extracted):
+                    self._remove(path)
+                    if doc:
+                        self._add(path, *doc)
+                    else:
+                        # removed in the meantime; check the student again next time
+                        retry.add(path.split("/", 1)[0])
+                for student in removed:
+                    del self._students[student]
+                self._students.update({s: students[s] for s in changed if s not in retry})
+                self._refreshed_at = time.monotonic()
+                data = self._to_json() if stale or to_extract or removed or changed else None
+            if data:
+                self._save(data)
+        finally:
+            self._refresh_lock.release()
+
+    def _candidates(self, query: str) -> set[str]:
+        sets = []
+        for term in tokenize(query):
+            if term.isascii():
+                # prefix match, since words of the text may be longer than those of the query
+                if self._ascii_terms is None:
+                    self._ascii_terms = sorted(t for t in self._postings if t.isascii())
+                start = bisect.bisect_left(self._ascii_terms, term)
+                end = bisect.bisect_left(self._ascii_terms, term + "\U0010ffff", start)
+                postings = [self._postings[t] for t in self._ascii_terms[start:end]]
+            elif len(term) == 1:
+                # single characters are indexed as part of bigrams, unless they are a whole run
+                terms = self._char_terms.get(term, set()) | {term}
+                postings = [self._postings[t] for t in terms if t in self._postings]
+            else:
+                postings = [self._postings.get(term, set())]
+            sets.append(set().union(*postings))
+        return set.intersection(*sets) if sets else set(self._docs)
+
+    def _extract(self, path: str) -> tuple[list, str] | None:
+        file_path = os.path.join(self.assignment_dir, path)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        try:
+            if path.lower().endswith(".pdf"):
+                text = pdf_to_text(file_path)
+            else:
+                with open(file_path, encoding="utf-8", errors="replace") as f:
+                    text = html_to_text(f.read())
+        except Exception:
+            # broken files are indexed as empty, and extracted again when they change
+            text = ""
+        return [stat.st_mtime_ns, stat.st_size], normalize(text)
+
+    def _add(self, path: str, signature: list, text: str):
+        self._docs[path] = (signature, text)
+        for term in tokenize(text):
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = set()
+                self._add_term(term)
+            postings.add(path)
+
+    def _remove(self, path: str):
+        doc = self._docs.pop(path, None)
+        if not doc:
+            return
+        for term in tokenize(doc[1]):
+            postings = self._postings.get(term)
+            if postings:
+                postings.discard(path)
+                if not postings:
+                    del self._postings[term]
+                    self._remove_term(term)
+
+    def _add_term(self, term: str):
+        if term.isascii():
+            self._ascii_terms = None
+        elif len(term) == 2:
+            for char in term:
+                self._char_terms.setdefault(char, set()).add(term)
+
+    def _remove_term(self, term: str):
+        if term.isascii():
+            self._ascii_terms = None
+        elif len(term) == 2:
+            for char in term:
+                terms = self._char_terms.get(char)
+                if terms:
+                    terms.discard(term)
+                    if not terms:
+                        del self._char_terms[char]
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if data.get("format") != INDEX_FORMAT or data.get("assignment_dir") != self.assignment_dir:
+            return
+        for path, (signature, text) in data["docs"].items():
+            self._add(path, signature, text)
+        # list all students again if a PDF extractor was installed or removed since the index was saved
+        if data.get("pdf") == self._pdf:
+            self._students = {s: tuple(sig) for s, sig in data["students"].items()}
+
+    def _to_json(self) -> dict:
+        return {
+            "format": INDEX_FORMAT,
+            "assignment_dir": self.assignment_dir,
+            "pdf": self._pdf,
+            "students": dict(self._students),
+            "docs": dict(self._docs),
+        }
+
+    def _save(self, data: dict):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+
+def _list_documents(assignment_dir: str, student: str, pdf: bool) -> dict[str, list]:
+    """
+    Indexable files of a student (submitted text, and PDF attachments if `pdf`) with their mtime and size.
+    Keys are paths relative to the assignment directory, e.g. `Name(ID)/Name_submissionText.html`.
+    """
+    documents = {}
+    student_dir = os.path.join(assignment_dir, student)
+    try:
+        with os.scandir(student_dir) as it:
+            entries = [(e.name, e) for e in it if e.name.endswith("_submissionText.html")]
+    except FileNotFoundError:
+        return documents
+    if pdf:
+        try:
+            with os.scandir(os.path.join(student_dir, ATTACHMENTS_DIR_NAME)) as it:
+                entries += [(f"{ATTACHMENTS_DIR_NAME}/{e.name}", e) for e in it if e.name.lower().endswith(".pdf")]
+        except FileNotFoundError:
+            pass
+    for rel, entry in entries:
+        if entry.is_file():
+            stat = entry.stat()
+            documents[f"{student}/{rel}"] = [stat.st_mtime_ns, stat.st_size]
+    return documents
+
+
+_indexes: dict[str, AssignmentIndex] = {}
+_indexes_lock = threading.Lock()
+_refresh_pool = ThreadPoolExecutor(max_workers=1)
+_refresh_queued: set[str] = set()
+
+
+def get_search_index(index_dir: str, assignment_dir: str) -> AssignmentIndex:
+    """Return the process-wide `AssignmentIndex` of the assignment, stored under `index_dir`."""
+    key = os.path.abspath(assignment_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] + ".json"
+            _indexes[key] = AssignmentIndex(key, os.path.join(index_dir, name))
+        return _indexes[key]
+
+
+def refresh_async(index: AssignmentIndex):
+    """Update the index on a background thread, e.g. right after an assignment is added."""
+    with _indexes_lock:
+        # a queued refresh also sees the files added meanwhile
+        if index.assignment_dir in _refresh_queued:
+            return
+        _refresh_queued.add(index.assignment_dir)
+
+    def run():
+        with _indexes_lock:
+            _refresh_queued.discard(index.assignment_dir)
+        index.refresh()
+
+    _refresh_pool.submit(run)
@@ -0,0 +1,337 @@
+import atexit
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+# Substrings of the paths of folders managed by cloud sync clients, and the name of the service
+CLOUD_MARKERS = (
+    ("OneDrive", "OneDrive"),
+    ("Google Drive", "Google Drive"),
+    ("GoogleDrive", "Google Drive"),
+    ("Mobile Documents", "iCloud"),
+    ("Dropbox", "Dropbox"),
+)
+# Seconds to wait for queued writes when the process exits
+EXIT_TIMEOUT = 30.0
+# Seconds a page waits for queued writes, e.g. before exporting
+FLUSH_TIMEOUT = 30.0
+# Attempts of a write failing with `OSError`, with delays of 0.5, 1, 2 and 4 seconds in between
+MAX_ATTEMPTS = 5
+
+
+def cloud_provider(path: str) -> str | None:
+    """Return the name of the cloud service syncing the path, e.g. `OneDrive`, or None for a local folder."""
+    for marker, name in CLOUD_MARKERS:
+        if marker in path:
+            return name
+    return None
+
+
+class WritesBlockedError(Exception):
+    """Raised when saving into a directory whose files are being migrated."""
+
+
+def write_behind_enabled(path: str) -> bool:
+    """
+    Whether writes under the path go through the `WriteBehindQueue`.
+
+    Only folders synced by a cloud service are slow enough to write in the background; writes to local
+    folders stay synchronous, so a saved grade is on disk when the save returns.
+    """
+    return cloud_provider(path) is not None
+
+
+class LocalMirror:
+    """
+    Size-bounded local read-through cache of files under a cloud-synced directory.
+
+    Reading a file which is "online only" makes the sync client download it, which can take seconds.
+    The first read copies the file into the cache, and later reads use the copy for as long as the mtime and
+    size of the original are unchanged (stat only needs the metadata, which the sync clients keep locally).
+    Copies keep the name of the original, so that downloads from the file server have the right name.
+    The least recently used copies are evicted once the cache exceeds `max_bytes`.
+    If the mirror is disabled, `get` returns the original path.
+    """
+
+    def __init__(self, root: str, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.root = os.path.abspath(root)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self._pool = ThreadPoolExecutor(max_workers=4)
+
+    def get(self, path: str) -> str:
+        """
+        Return the path of a local copy of the file, copying it if necessary.
+
+        Files outside of `root` are returned as they are.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the original file does not exist.
+        """
+        path = os.path.abspath(path)
+        if not self.enabled or not path.startswith(self.root + os.sep):
+            return path
+        stat = os.stat(path)
+        dest = self._mirror_path(path, stat)
+        if os.path.exists(dest):
+            # update mtime for LRU eviction
+            os.utime(dest)
+            return dest
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f"{dest}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dest)
+        self._add_size(stat.st_size)
+        return dest
+
+    def prefetch(self, paths: list[str]):
+        """Copy the files on background threads."""
+        if self.enabled:
+            for path in paths:
+                self._pool.submit(self._get_quietly, path)
+
+    def evict(self):
+        """Remove the least recently used copies until the cache fits in `max_bytes`."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_dir():
+                    continue
+                for file in os.scandir(entry.path):
+                    if file.is_file() and not file.name.endswith(".tmp"):
+                        stat = file.stat()
+                        entries.append((stat.st_mtime, stat.st_size, file.path))
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    os.rmdir(os.path.dirname(path))
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    # the directory is not empty, e.g. a copy is being written
+                    self._size -= size
+
+    def _get_quietly(self, path: str):
+        try:
+            self.get(path)
+        except Exception:
+            # errors are reported when the file is displayed
+            pass
+
+    def _add_size(self, size: int):
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _mirror_path(self, path: str, stat: os.stat_result) -> str:
+        key = f"{os.path.relpath(path, self.root)}\0{stat.st_mtime_ns}\0{stat.st_size}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.cache_dir, digest, os.path.basename(path))
+
+
+@dataclass
+class QueuedWrite:
+    label: str  # shown to the user, e.g. the file written
+    fn: object
+    args: tuple
+    on_discard: object = None  # called if the user discards the failed write
+    error: Exception | None = field(default=None, compare=False)
+
+
+class WriteBehindQueue:
+    """
+    Writes to the save directory, run in order on a background thread.
+
+    The app applies a write to its in-memory state and queues the file operation, so saving never waits for
+    the sync client. A write failing with `OSError` (e.g. a file locked by the sync client) is retried
+    `MAX_ATTEMPTS` times with backoff. A write which still fails, or fails with another exception, is moved to
+    `failed`, where it stays until the user retries or discards it, and the queue goes on with later writes.
+    Queued writes are flushed at exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._queue: deque[QueuedWrite] = deque()
+        self._running = False
+        self._thread: threading.Thread | None = None
+        self._failed: list[QueuedWrite] = []
+        self.last_error: Exception | None = None  # error of the write being retried, if any
+        atexit.register(self.flush, EXIT_TIMEOUT)
+
+    @property
+    def pending(self) -> int:
+        """Number of writes which are queued or running."""
+        with self._lock:
+            return len(self._queue) + self._running
+
+    @property
+    def failed(self) -> list[QueuedWrite]:
+        """Writes which failed after all attempts, oldest first."""
+        with self._lock:
+            return list(self._failed)
+
+    def submit(self, label: str, fn, *args, on_discard=None):
+        """Queue a call of `fn(*args)`. `on_discard` undoes its in-memory effects if the write is discarded."""
+        self._enqueue([QueuedWrite(label, fn, args, on_discard)])
+
+    def retry_failed(self):
+        """Queue the failed writes again."""
+        with self._lock:
+            writes, self._failed = self._failed, []
+        self._enqueue(writes)
+
+    def discard_failed(self):
+        """Forget the failed writes, undoing their in-memory effects."""
+        with self._lock:
+            writes, self._failed = self._failed, []
+        for write in writes:
+            if write.on_discard:
+                write.on_discard()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until all queued writes are done or failed. Return False on timeout."""
+        if self._thread is threading.current_thread():
+            raise RuntimeError("flush cannot be called from a queued write")
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._queue and not self._running, timeout)
+
+    def _enqueue(self, writes: list[QueuedWrite]):
+        if not writes:
+            return
+        with self._lock:
+            self._queue.extend(writes)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._lock.notify_all()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._lock.wait_for(lambda: self._queue, timeout=60):
+                    # the next `submit` starts a new thread
+                    self._thread = None
+                    return
+                write = self._queue.popleft()
+                self._running = True
+            write.error = None
+            delay = 0.5
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    write.fn(*write.args)
+                    write.error = None
+                    break
+                except OSError as e:
+                    write.error = self.last_error = e
+                    if attempt < MAX_ATTEMPTS:
+                        time.sleep(delay)
+                        delay *= 2
+                except Exception as e:
+                    # a bug in the write itself, which retrying does not fix
+                    write.error = e
+                    break
+            with self._lock:
+                self.last_error = None
+                if write.error is not None:
+                    self._failed.append(write)
+                self._running = False
+                self._lock.notify_all()
+
+
+def write_text_atomic(path: str, text: str):
+    """Replace the content of a text file, so that the sync client never uploads a half-written file."""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+_blocked_dirs: set[str] = set()
+_writes = threading.Condition()
+_writes_running = 0
+
+
+@contextmanager
+def guarded_write(path: str):
+    """
+    Context manager around a save into the save directory, i.e. a write or the submission of a queued write.
+
+    Raises
+    ------
+    WritesBlockedError
+        If the path is in a directory blocked by `block_writes`.
+    """
+    global _writes_running
+    with _writes:
+        if writes_blocked(path):
+            raise WritesBlockedError(f"データ移行中のため保存できません: {path}")
+        _writes_running += 1
+    try:
+        yield
+    finally:
+        with _writes:
+            _writes_running -= 1
+            _writes.notify_all()
+
+
+def writes_blocked(path: str) -> bool:
+    """Whether saves into the path are blocked by `block_writes`."""
+    path = os.path.abspath(path)
+    return any(path == d or path.startswith(d + os.sep) for d in _blocked_dirs)
+
+
+def block_writes(root: str):
+    """Refuse saves into the directory from now on, and wait for the running ones to finish."""
+    with _writes:
+        _blocked_dirs.add(os.path.abspath(root))
+        _writes.wait_for(lambda: _writes_running == 0)
+
+
+def unblock_writes(root: str):
+    """Allow saves into the directory again."""
+    with _writes:
+        _blocked_dirs.discard(os.path.abspath(root))
+
+
+_mirrors: dict[tuple, LocalMirror] = {}
+_mirrors_lock = threading.Lock()
+_write_behind: WriteBehindQueue | None = None
+_write_behind_lock = threading.Lock()
+
+
+def get_mirror(root: str, cache_dir: str, max_bytes: int, enabled: bool = True) -> LocalMirror:
+    """Return the process-wide `LocalMirror` for the given settings."""
+    key = (os.path.abspath(root), os.path.abspath(cache_dir), max_bytes, enabled)
+    with _mirrors_lock:
+        if key not in _mirrors:
+            _mirrors[key] = LocalMirror(*key)
+        return _mirrors[key]
+
+
+def get_write_behind() -> WriteBehindQueue:
+    """Return the process-wide `WriteBehindQueue`."""
+    global _write_behind
+    with _write_behind_lock:
+        if _write_behind is None:
+            _write_behind = WriteBehindQueue()
+        return _write_behind